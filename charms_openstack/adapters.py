@@ -15,8 +15,9 @@
 """Adapter classes and utilities for use with Reactive interfaces"""
 from __future__ import absolute_import
 
-import itertools
+import copy
 import re
+import threading
 import weakref
 
 import six
@@ -60,6 +61,104 @@ def adapter_property(interface_name):
     return wrapper
 
 
+# Hold the complete settings of each remote unit, keyed by (relation_id, unit),
+# that have been fetched during this hook.  This allows the accessors of the
+# relation adapters to be served from memory rather than by calling
+# relation-get for every key of every unit.
+_relation_settings = {}
+
+
+def get_relation_settings(relation_id, unit):
+    """Return all of the relation settings for a remote unit using a single
+    relation-get call.  The result is remembered for the rest of the hook.
+
+    :param relation_id: the relation id, e.g. 'amqp:1'
+    :param unit: the remote unit, e.g. 'rabbitmq-server/0'
+    :returns: dictionary of the unit's settings on the relation.
+    """
+    key = (relation_id, unit)
+    try:
+        return _relation_settings[key]
+    except KeyError:
+        settings = hookenv.relation_get(unit=unit, rid=relation_id) or {}
+        _relation_settings[key] = settings
+        return settings
+
+
+def flush_relation_settings():
+    """Forget any relation settings fetched by get_relation_settings(), and
+    the cluster hosts built from them, so that they are fetched again on next
+    use.
+    """
+    _relation_settings.clear()
+    _cluster_hosts.clear()
+
+
+def _conversation_units(conversation):
+    """Return the (relation_id, unit) pairs of the remote units in a
+    conversation, in the same order as the conversation's get_remote() method
+    looks at them.
+
+    :param conversation: a charms.reactive Conversation
+    :returns: list of (relation_id, unit) tuples
+    """
+    cur_rid = hookenv.relation_id()
+    departing = hookenv.hook_name().endswith('-relation-departed')
+    pairs = []
+    for relation_id in conversation.relation_ids:
+        units = list(hookenv.related_units(relation_id))
+        if departing and cur_rid == relation_id:
+            # the departing unit isn't in relation-list in the -departed
+            # hook, so add it back in.
+            units.append(hookenv.remote_unit())
+        pairs.extend((relation_id, unit)
+                     for unit in units if unit in conversation.units)
+    return pairs
+
+
+# Hold the subclasses of the relation adapters that have the accessor
+# properties for a set of accessors, keyed by (adapter class, accessors), so
+# that they are only created once.
+_accessor_classes = {}
+_accessor_classes_lock = threading.Lock()
+
+
+# Hold the classes created by make_default_configuration_adapter_class() and
+# make_default_relation_adapter(), keyed by the base class, the relation (if
+# any) and the custom property functions, so that they are only created once.
+_default_adapter_classes = {}
+
+
+# Hold the Juju config last seen by a ConfigurationAdapter, along with its
+# map of attribute name -> config key and the attributes of each adapter class
+# that the config shadows, so that they are only worked out once per hook.
+_config_attributes = {'config': None, 'size': 0, 'map': {}, 'shadowed': {}}
+
+
+def _get_config_attributes(config):
+    """Return the cached attribute information for the Juju config, building
+    it if the config isn't the one that was last seen.
+
+    :param config: the dictionary returned by hookenv.config()
+    :returns: dictionary with 'map' and 'shadowed' entries
+    """
+    global _config_attributes
+    if (_config_attributes['config'] is not config or
+            _config_attributes['size'] != len(config)):
+        _config_attributes = {
+            'config': config,
+            'size': len(config),
+            'map': {k.replace('-', '_'): k for k in config},
+            'shadowed': {},
+        }
+    return _config_attributes
+
+
+# Hold the cluster_hosts map built by PeerHARelationAdapter for this hook,
+# keyed by the relation name, local address and configured networks.
+_cluster_hosts = {}
+
+
 # declaring custom configuration properties:
 
 # Hold the custom configuration adapter properties somewhere!
@@ -85,6 +184,124 @@ def config_property(f):
 ##
 
 
+class _ReadOnlyDict(dict):
+    """A dict that refuses to be modified; used for frozen adapter values"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Frozen adapter values can't be modified")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+
+class _ReadOnlyList(list):
+    """A list that refuses to be modified; used for frozen adapter values"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Frozen adapter values can't be modified")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = reverse = sort = _readonly
+
+
+class _ReadOnlySet(set):
+    """A set that refuses to be modified; used for frozen adapter values"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Frozen adapter values can't be modified")
+
+    __ior__ = __iand__ = __ixor__ = __isub__ = _readonly
+    add = clear = discard = pop = remove = update = _readonly
+    difference_update = intersection_update = _readonly
+    symmetric_difference_update = _readonly
+
+    def __repr__(self):
+        return repr(set(self))
+
+
+def _freeze_value(value):
+    """Convert a value resolved from an adapter into a read-only version of
+    itself.  Adapters (and adapters instances) are wrapped in a FrozenAdapter
+    so that their values are also only resolved once.
+
+    :param value: the value to freeze
+    :returns: the read-only version of value
+    """
+    if isinstance(value, (OpenStackRelationAdapter,
+                          ConfigurationAdapter,
+                          OpenStackRelationAdapters)):
+        return FrozenAdapter(value)
+    if isinstance(value, dict):
+        return _ReadOnlyDict((k, _freeze_value(v))
+                             for k, v in six.iteritems(value))
+    if isinstance(value, list):
+        return _ReadOnlyList(_freeze_value(v) for v in value)
+    if isinstance(value, tuple) and not hasattr(value, '_fields'):
+        return tuple(_freeze_value(v) for v in value)
+    if isinstance(value, set):
+        return _ReadOnlySet(value)
+    return value
+
+
+class FrozenAdapter(object):
+    """A read-only snapshot of an adapter (or an adapters instance).
+
+    Each attribute of the wrapped adapter (accessor, property or config item)
+    is resolved at most once, on first access, and the result is then held as
+    read-only data.  This means that a single FrozenAdapter can be shared
+    between all of the templates rendered in a pass without calling out to
+    relation-get, config-get, etc. more than once for any value.
+
+    Methods of the wrapped adapter are passed through (bound to the live
+    adapter) so that templates can still call them.  If resolving a value
+    raised an exception then the same exception is raised on each access so
+    that templates see exactly what they would have seen with the live
+    adapter.
+    """
+
+    def __init__(self, adapter):
+        """
+        :param adapter: the adapter, or adapters instance, to snapshot.
+        """
+        object.__setattr__(self, '_adapter', adapter)
+        object.__setattr__(self, '_resolved', {})
+
+    def __getattr__(self, name):
+        if name in ('_adapter', '_resolved'):
+            raise AttributeError(name)
+        try:
+            value, exc = self._resolved[name]
+        except KeyError:
+            value, exc = None, None
+            try:
+                value = getattr(self._adapter, name)
+                if not callable(value):
+                    value = _freeze_value(value)
+            except Exception as e:
+                exc = e
+            self._resolved[name] = (value, exc)
+        if exc is not None:
+            raise exc
+        return value
+
+    def __setattr__(self, name, value):
+        raise AttributeError(
+            "Can't set '{}' on a frozen adapter".format(name))
+
+    def __delattr__(self, name):
+        raise AttributeError(
+            "Can't delete '{}' from a frozen adapter".format(name))
+
+    def __iter__(self):
+        """Iterate over the adapters of a frozen adapters instance, yielding
+        the frozen version of each adapter.
+        """
+        for name, value in self._adapter:
+            if name not in self._resolved:
+                self._resolved[name] = (_freeze_value(value), None)
+            yield name, getattr(self, name)
+
+
 class OpenStackRelationAdapter(object):
     """
     Base adapter class for all OpenStack related adapters.
@@ -105,10 +322,11 @@ class OpenStackRelationAdapter(object):
            :param relation_name: String name of relation
         """
         self.relation = relation
+        self._remote_settings = None
         if relation and relation_name:
             raise ValueError('Cannot speciiy relation and relation_name')
         if relation:
-            self.accessors = accessors or []
+            self.accessors = list(accessors or [])
             self._setup_properties()
         else:
             self._relation_name = relation_name
@@ -128,22 +346,88 @@ class OpenStackRelationAdapter(object):
         Setup property based accessors for an interfaces
         auto accessors
 
-        Note that the accessor is dynamic as each access calls the underlying
-        getattr() for each property access.
+        Note that the accessor is dynamic as each access calls
+        get_accessor() for each property access.
+
+        The properties live on a subclass of the adapter's class that is
+        created once for each set of accessors and then shared, so that
+        adapters for different relations don't see each other's accessors.
         """
         self.accessors.extend(self.relation.auto_accessors)
-        for field in self.accessors:
-            meth_name = field.replace('-', '_')
-            # Get the relation property dynamically
-            # Note the additional lambda name: is to create a closure over
-            # meth_name so that a new 'name' gets created for each loop,
-            # otherwise the same variable meth_name is referenced in each of
-            # the internal lambdas.  i.e. this is (lambda x: ...)(value)
-            setattr(self.__class__,
-                    meth_name,
-                    (lambda name: property(
-                        lambda self: getattr(
-                            self.relation, name)()))(meth_name))
+        cls = self.__class__
+        key = (cls, frozenset(self.accessors))
+        with _accessor_classes_lock:
+            try:
+                accessor_class = _accessor_classes[key]
+            except KeyError:
+                members = {'__module__': cls.__module__,
+                           '__doc__': cls.__doc__}
+                for field in self.accessors:
+                    # Get the relation property dynamically
+                    # Note the additional lambda field: is to create a
+                    # closure over field so that a new 'field' gets created
+                    # for each loop, otherwise the same variable field is
+                    # referenced in each of the internal lambdas.  i.e. this
+                    # is (lambda x: ...)(value)
+                    members[field.replace('-', '_')] = (
+                        lambda field: property(
+                            lambda self: self.get_accessor(field)))(field)
+                accessor_class = type(cls.__name__, (cls, ), members)
+                _accessor_classes[key] = accessor_class
+        self.__class__ = accessor_class
+
+    def prefetch(self):
+        """Fetch all of the settings of the remote units in the relation's
+        current conversation, using one relation-get per unit, so that the
+        auto accessors can be served from memory.
+
+        The units (and order) used are the same as those used by the
+        conversation's get_remote() method.  The settings are remembered on
+        the adapter, and for the hook by get_relation_settings().
+
+        :returns: list of settings dictionaries, one per unit, or None if the
+            relation can't be prefetched (e.g. it isn't conversation based).
+        """
+        if self._remote_settings is None:
+            conversation = None
+            if hasattr(self.relation, 'conversation'):
+                try:
+                    conversation = self.relation.conversation()
+                except ValueError:
+                    # there is no conversation in scope in this hook
+                    pass
+            if conversation is None:
+                # Fall back to calling the relation's accessors directly
+                settings = False
+            else:
+                settings = [
+                    get_relation_settings(relation_id, unit)
+                    for relation_id, unit in _conversation_units(
+                        conversation)]
+            self._remote_settings = settings
+        if self._remote_settings is False:
+            return None
+        return self._remote_settings
+
+    def get_accessor(self, field):
+        """Return the value of an accessor on the relation.
+
+        Auto accessors are served from the prefetched relation settings (the
+        first unit that has a value for the field wins, just as with
+        get_remote()).  Any other accessor calls the method on the relation.
+
+        :param field: the accessor, e.g. 'private-address'
+        :returns: the value of the accessor
+        """
+        if field in self.relation.auto_accessors:
+            settings = self.prefetch()
+            if settings is not None:
+                for unit_settings in settings:
+                    value = unit_settings.get(field)
+                    if value:
+                        return value
+                return None
+        return getattr(self.relation, field.replace('-', '_'))()
 
 
 class RabbitMQRelationAdapter(OpenStackRelationAdapter):
@@ -226,9 +510,23 @@ class PeerHARelationAdapter(OpenStackRelationAdapter):
         self.local_address = self.api_config_adapter.local_address
         self.local_unit_name = self.api_config_adapter.local_unit_name
         self.cluster_hosts = {}
+        self._peer_addresses = None
         if relation:
-            self.add_network_split_addresses()
-            self.add_default_addresses()
+            key = self._cluster_hosts_key()
+            if key not in _cluster_hosts:
+                self.add_network_split_addresses()
+                self.add_default_addresses()
+                _cluster_hosts[key] = self.cluster_hosts
+            self.cluster_hosts = copy.deepcopy(_cluster_hosts[key])
+
+    def _cluster_hosts_key(self, *extra):
+        """Return the key for this adapter's entries in `_cluster_hosts`: the
+        relation name, local address and configured networks, plus any extra
+        values.
+        """
+        return (self.relation_name, self.local_address) + tuple(
+            self.config.get(os_ip.ADDRESS_MAP[addr_type]['config'])
+            for addr_type in ADDRESS_TYPES) + extra
 
     @property
     def internal_addresses(self):
@@ -241,7 +539,7 @@ class PeerHARelationAdapter(OpenStackRelationAdapter):
         """
         cfg_opt = os_ip.ADDRESS_MAP[os_ip.INTERNAL]['config']
         int_net = self.config.get(cfg_opt)
-        laddr = ch_ip.get_address_in_network(int_net) or self.local_address
+        laddr = os_ip.get_address_in_network(int_net) or self.local_address
         try:
             hosts = sorted(
                 list(self.cluster_hosts[laddr]['backends'].values()))
@@ -261,20 +559,61 @@ class PeerHARelationAdapter(OpenStackRelationAdapter):
                         'network': 'this_unit_private_addr/private_netmask'},
                 'internal_addresses': ['intaddr']}
         """
-        relation_info = {}
         try:
             cluster_relid = hookenv.relation_ids('cluster')[0]
-            if not hookenv.related_units(relid=cluster_relid):
-                relation_info = {
-                    'cluster_hosts': self.local_default_addresses(),
-                    'internal_addresses': self.internal_addresses,
-                }
-                net_split = self.local_network_split_addresses()
-                for key in net_split.keys():
-                    relation_info['cluster_hosts'][key] = net_split[key]
         except IndexError:
-            pass
-        return relation_info
+            return {}
+        if hookenv.related_units(relid=cluster_relid):
+            return {}
+        # the map is built once per hook, like cluster_hosts
+        key = self._cluster_hosts_key('single-mode', cluster_relid)
+        if key not in _cluster_hosts:
+            relation_info = {
+                'cluster_hosts': self.local_default_addresses(),
+                'internal_addresses': self.internal_addresses,
+            }
+            net_split = self.local_network_split_addresses()
+            for addr in net_split.keys():
+                relation_info['cluster_hosts'][addr] = net_split[addr]
+            _cluster_hosts[key] = relation_info
+        return copy.deepcopy(_cluster_hosts[key])
+
+    def peer_addresses(self, address_key='private-address'):
+        """Return the addresses of the peers for the address key.
+
+        The addresses for all of the address keys are gathered in a single
+        pass over the peers, from the settings fetched once per peer by
+        get_relation_settings().  If the relation isn't conversation based
+        then its ip_map() method is used instead.
+
+        :param address_key: the relation setting, e.g. 'admin-address'
+        @return list of (unit-name, address) tuples, e.g.
+            [('peer_unit-1', 'peer_unit1_addr'), ...]
+        """
+        if self._peer_addresses is None:
+            keys = ['private-address'] + [
+                '{}-address'.format(os_ip.ADDRESS_MAP[addr_type]['binding'])
+                for addr_type in ADDRESS_TYPES]
+            if hasattr(self.relation, 'conversations'):
+                peer_addresses = {key: [] for key in keys}
+                for conv in self.relation.conversations():
+                    unit_name = conv.scope.replace('/', '-')
+                    settings = [get_relation_settings(relation_id, unit)
+                                for relation_id, unit in
+                                _conversation_units(conv)]
+                    for key in keys:
+                        # the first unit with a value wins, as with
+                        # get_remote()
+                        addr = next((s[key] for s in settings if s.get(key)),
+                                    None)
+                        if addr:
+                            peer_addresses[key].append((unit_name, addr))
+            else:
+                peer_addresses = {key: self.relation.ip_map(address_key=key)
+                                  for key in keys[1:]}
+                peer_addresses['private-address'] = self.relation.ip_map()
+            self._peer_addresses = peer_addresses
+        return self._peer_addresses[address_key]
 
     def local_network_split_addresses(self):
         """Map of local units addresses for each address type
@@ -298,9 +637,9 @@ class PeerHARelationAdapter(OpenStackRelationAdapter):
         _cluster_hosts = {}
         for addr_type in ADDRESS_TYPES:
             cfg_opt = os_ip.ADDRESS_MAP[addr_type]['config']
-            laddr = ch_ip.get_address_in_network(config.get(cfg_opt))
+            laddr = os_ip.get_address_in_network(config.get(cfg_opt))
             if laddr:
-                netmask = ch_ip.get_netmask_for_address(laddr)
+                netmask = os_ip.get_netmask_for_address(laddr)
                 _cluster_hosts[laddr] = {
                     'network': "{}/{}".format(laddr, netmask),
                     'backends': {self.local_unit_name: laddr}}
@@ -316,7 +655,7 @@ class PeerHARelationAdapter(OpenStackRelationAdapter):
                     'network': 'this_unit_private_addr/private_netmask'}}
 
         """
-        netmask = ch_ip.get_netmask_for_address(self.local_address)
+        netmask = os_ip.get_netmask_for_address(self.local_address)
         _local_map = {
             self.local_address: {
                 'network': "{}/{}".format(self.local_address, netmask),
@@ -329,15 +668,15 @@ class PeerHARelationAdapter(OpenStackRelationAdapter):
 
            @return None
         """
+        local_split = self.local_network_split_addresses()
         for addr_type in ADDRESS_TYPES:
             cfg_opt = os_ip.ADDRESS_MAP[addr_type]['config']
-            laddr = ch_ip.get_address_in_network(self.config.get(cfg_opt))
+            laddr = os_ip.get_address_in_network(self.config.get(cfg_opt))
             if laddr:
-                self.cluster_hosts[laddr] = \
-                    self.local_network_split_addresses()[laddr]
+                self.cluster_hosts[laddr] = local_split[laddr]
                 key = '{}-address'.format(
                     os_ip.ADDRESS_MAP[addr_type]['binding'])
-                for _unit, _laddr in self.relation.ip_map(address_key=key):
+                for _unit, _laddr in self.peer_addresses(key):
                     if _laddr:
                         self.cluster_hosts[laddr]['backends'][_unit] = _laddr
 
@@ -349,7 +688,7 @@ class PeerHARelationAdapter(OpenStackRelationAdapter):
         """
         self.cluster_hosts[self.local_address] = \
             self.local_default_addresses()[self.local_address]
-        for _unit, _laddr in self.relation.ip_map():
+        for _unit, _laddr in self.peer_addresses():
             self.cluster_hosts[self.local_address]['backends'][_unit] = _laddr
 
 
@@ -430,6 +769,9 @@ def make_default_configuration_adapter_class(base_cls=None,
     This is called by the charm creation metaclass when 'bringing' up the class
     if no configuration adapter has been specified in the adapters_class
 
+    The class is only created once for each base_cls and set of custom
+    properties; later calls return the same class.
+
     :param base_cls: a ConfigurationAdapter derived class; or None
     :param custom_properties: the name:function for the properties to set.
     """
@@ -437,10 +779,17 @@ def make_default_configuration_adapter_class(base_cls=None,
     # if there are no custom properties, just return the base_cls
     if not custom_properties:
         return base_cls
+    key = (base_cls, None, frozenset(six.iteritems(custom_properties)))
+    try:
+        return _default_adapter_classes[key]
+    except KeyError:
+        pass
     # turns the functions into properties on the class
     properties = {n: property(f) for n, f in six.iteritems(custom_properties)}
     # build a custom class with the custom properties
-    return type('DefaultConfigurationAdapter', (base_cls, ), properties)
+    cls = type('DefaultConfigurationAdapter', (base_cls, ), properties)
+    _default_adapter_classes[key] = cls
+    return cls
 
 
 class ConfigurationAdapter(object):
@@ -453,8 +802,10 @@ class ConfigurationAdapter(object):
     adapter can query the charm class for global config (e.g. service_name).
 
 
-    The configuration items from Juju are copied over and the '-' are replaced
-    with '_'.  This allows them to be used directly on the instance.
+    The configuration items from Juju are available as attributes with the
+    '-' replaced with '_'.  This allows them to be used directly on the
+    instance.  They are fetched from the config on first access, rather than
+    all being copied when the adapter is created.
     """
 
     def __init__(self, charm_instance=None):
@@ -466,11 +817,38 @@ class ConfigurationAdapter(object):
         self._charm_instance_weakref = None
         if charm_instance is not None:
             self._charm_instance_weakref = weakref.ref(charm_instance)
-        # copy over (statically) the items of the charms Juju configuration
         _config = hookenv.config()
-        for k, v in six.iteritems(_config):
-            k = k.replace('-', '_')
-            setattr(self, k, v)
+        attributes = _get_config_attributes(_config)
+        self._config = _config
+        self._config_map = attributes['map']
+        # config items that have the same name as a class attribute have
+        # always replaced it on the instance, so those are copied over now.
+        cls = self.__class__
+        try:
+            shadowed = attributes['shadowed'][cls]
+        except KeyError:
+            shadowed = attributes['shadowed'][cls] = [
+                k for k in self._config_map if hasattr(cls, k)]
+        for k in shadowed:
+            setattr(self, k, _config[self._config_map[k]])
+
+    def __getattr__(self, name):
+        """Return the config item for name (with '_' for '-'), remembering it
+        on the instance for subsequent accesses.
+        """
+        try:
+            key = self.__dict__['_config_map'][name]
+        except KeyError:
+            if hasattr(type(self), name):
+                # Python calls __getattr__ when a property raises
+                # AttributeError; evaluate it again so that the caller sees
+                # the real error rather than a missing attribute.
+                return object.__getattribute__(self, name)
+            raise AttributeError("'{}' object has no attribute '{}'"
+                                 .format(self.__class__.__name__, name))
+        value = self.__dict__['_config'][key]
+        setattr(self, name, value)
+        return value
 
     @property
     def charm_instance(self):
@@ -528,6 +906,8 @@ class APIConfigurationAdapter(ConfigurationAdapter):
         else:
             self.service_name = None
         self.__network_addresses = None
+        self.__port_table = (None, [])
+        self.__derived_ports = {}
 
     @property
     def network_addresses(self):
@@ -542,6 +922,40 @@ class APIConfigurationAdapter(ConfigurationAdapter):
             self.__network_addresses = self.get_network_addresses()
         return self.__network_addresses
 
+    @property
+    def port_table(self):
+        """Return the self.port_map flattened into a list of
+        (service, port_type, port) tuples, with the port types of each service
+        in sorted order.
+
+        The table is built once (per port_map) and the various port and
+        endpoint views are derived from it.
+
+        @return [('svc1', 'admin', 9001), ('svc1', 'internal', 9001), ...]
+        """
+        port_map, table = self.__port_table
+        if port_map is not self.port_map:
+            table = []
+            for service, ports in six.iteritems(self.port_map or {}):
+                for port_type in sorted(ports.keys()):
+                    table.append((service, port_type, ports[port_type]))
+            self.__port_table = (self.port_map, table)
+        return table
+
+    def _derived_port(self, f, port):
+        """Return f(port, singlenode_mode=True), calling f only once for each
+        port on this adapter.
+
+        :param f: ch_cluster.determine_apache_port or determine_api_port
+        :param port: the external port
+        """
+        key = (f, port)
+        try:
+            return self.__derived_ports[key]
+        except KeyError:
+            value = self.__derived_ports[key] = f(port, singlenode_mode=True)
+            return value
+
     @property
     def external_ports(self):
         """Return ports the service will be accessed on
@@ -551,10 +965,7 @@ class APIConfigurationAdapter(ConfigurationAdapter):
 
         @return set of ports service can be accessed on
         """
-        # the map take the first list of dictionaries to extract the 2nd level
-        # of values.
-        return set(itertools.chain(*map(lambda x: x.values(),
-                                        self.port_map.values())))
+        return set(port for _, _, port in self.port_table)
 
     @property
     def ipv6_mode(self):
@@ -623,24 +1034,19 @@ class APIConfigurationAdapter(ConfigurationAdapter):
         @return {'svc1': ['portA', 'portB'], 'svc2': ['portC', 'portD'], ...}
         """
         service_ports = {}
-        if self.port_map:
-            for service in self.port_map.keys():
-                port_types = sorted(list(self.port_map[service].keys()))
-                for port_type in port_types:
-                    listen_port = self.port_map[service][port_type]
-                    key = '{}_{}'.format(service, port_type)
-                    used_ports = [v[0] for v in service_ports.values()]
-                    if listen_port in used_ports:
-                        hookenv.log("Not adding haproxy listen stanza for {} "
-                                    "port is already in use".format(key),
-                                    level=hookenv.WARNING)
-                        continue
-                    service_ports[key] = [
-                        self.port_map[service][port_type],
-                        ch_cluster.determine_apache_port(
-                            self.port_map[service][port_type],
-                            singlenode_mode=True)]
-
+        used_ports = set()
+        for service, port_type, listen_port in self.port_table:
+            key = '{}_{}'.format(service, port_type)
+            if listen_port in used_ports:
+                hookenv.log("Not adding haproxy listen stanza for {} "
+                            "port is already in use".format(key),
+                            level=hookenv.WARNING)
+                continue
+            used_ports.add(listen_port)
+            service_ports[key] = [
+                listen_port,
+                self._derived_port(ch_cluster.determine_apache_port,
+                                   listen_port)]
         return service_ports
 
     @property
@@ -691,19 +1097,17 @@ class APIConfigurationAdapter(ConfigurationAdapter):
         """
         info = {}
         ip = self.local_host if self.apache_enabled else self.local_address
-        if self.port_map:
-            for service in self.port_map.keys():
-                key = service.replace('-', '_')
+        for service, port_type, port in self.port_table:
+            key = service.replace('-', '_')
+            if key not in info:
                 info[key] = {
                     'proto': 'http',
                     'ip': ip,
                     'port': self.determine_service_port(
                         self.port_map[service]['admin'])}
-                for port_type in self.port_map[service].keys():
-                    port_key = '{}_port'.format(port_type)
-                    info[key][port_key] = self.determine_service_port(
-                        self.port_map[service][port_type])
                 info[key]['url'] = '{proto}://{ip}:{port}'.format(**info[key])
+            info[key]['{}_port'.format(port_type)] = (
+                self.determine_service_port(port))
         return info
 
     @property
@@ -729,14 +1133,15 @@ class APIConfigurationAdapter(ConfigurationAdapter):
         #               an empty string.
         ip = getattr(self, 'vip', None) or self.local_address
         proto = 'https' if self.apache_enabled else 'http'
-        if self.port_map:
-            for service in self.port_map.keys():
-                key = service.replace('-', '_')
-                info[key] = {
-                    'proto': proto,
-                    'ip': ip,
-                    'port': self.port_map[service]['admin']}
-                info[key]['url'] = '{proto}://{ip}:{port}'.format(**info[key])
+        for service, port_type, port in self.port_table:
+            if port_type != 'admin':
+                continue
+            key = service.replace('-', '_')
+            info[key] = {
+                'proto': proto,
+                'ip': ip,
+                'port': port}
+            info[key]['url'] = '{proto}://{ip}:{port}'.format(**info[key])
         return info
 
     def get_network_addresses(self):
@@ -760,7 +1165,7 @@ class APIConfigurationAdapter(ConfigurationAdapter):
             net_cfg_opt = os_ip.ADDRESS_MAP[net_type]['config'].replace('-',
                                                                         '_')
             config_cidr = getattr(self, net_cfg_opt, None)
-            addr = ch_ip.get_address_in_network(
+            addr = os_ip.get_address_in_network(
                 config_cidr,
                 hookenv.unit_get('private-address'))
             addresses.append(
@@ -781,17 +1186,16 @@ class APIConfigurationAdapter(ConfigurationAdapter):
            ...
            ]
         """
+        ports = [
+            (int(self._derived_port(ch_cluster.determine_apache_port,
+                                    api_port)),
+             int(self._derived_port(ch_cluster.determine_api_port,
+                                    api_port)))
+            for api_port in sorted(self.external_ports)]
         endpoints = []
         for address, endpoint in sorted(set(self.network_addresses)):
-            for api_port in self.external_ports:
-                ext_port = ch_cluster.determine_apache_port(
-                    api_port,
-                    singlenode_mode=True)
-                int_port = ch_cluster.determine_api_port(
-                    api_port,
-                    singlenode_mode=True)
-                portmap = (address, endpoint, int(ext_port), int(int_port))
-                endpoints.append(portmap)
+            for ext_port, int_port in ports:
+                endpoints.append((address, endpoint, ext_port, int_port))
         return endpoints
 
     @property
@@ -800,17 +1204,20 @@ class APIConfigurationAdapter(ConfigurationAdapter):
 
             @returns List of ports
         """
-        eps = [ep[2] for ep in self.endpoints]
-        return sorted(list(set(eps)))
+        if not self.network_addresses:
+            return []
+        return sorted(set(
+            int(self._derived_port(ch_cluster.determine_apache_port, port))
+            for port in self.external_ports))
 
     @property
     def use_memcache(self):
-        release = ch_utils.get_os_codename_install_source(
+        release = os_release_data.get_os_codename_install_source(
             self.openstack_origin)
-        if release not in os_release_data.KNOWN_RELEASES:
+        ordinal = os_release_data.release_ordinal(release)
+        if ordinal is None:
             return ValueError("Unkown release {}".format(release))
-        return (os_release_data.KNOWN_RELEASES.index(release) >=
-                os_release_data.KNOWN_RELEASES.index('mitaka'))
+        return ordinal >= os_release_data.RELEASE_ORDINALS['mitaka']
 
     @property
     def memcache_server(self):
@@ -842,6 +1249,8 @@ def make_default_relation_adapter(base_cls, relation, properties):
     to provide a class that manages the relation for the charm.
 
     This mixes the associated RelationAdapter class with the custom relations.
+    The class is only created once for each base_cls, relation and set of
+    properties; later calls return the same class.
 
     :param base_cls: the class to use as the base for the properties
     :param relation: the relation we want the properties for
@@ -850,6 +1259,11 @@ def make_default_relation_adapter(base_cls, relation, properties):
     # Just return the base_cls if there's nothing to modify
     if not properties:
         return base_cls
+    key = (base_cls, relation, frozenset(six.iteritems(properties)))
+    try:
+        return _default_adapter_classes[key]
+    except KeyError:
+        pass
     # convert the functions into properties
     props = {n: property(f) for n, f in six.iteritems(properties)}
     # turn 'my-Something_interface' into 'MySomethingInterface'
@@ -860,7 +1274,9 @@ def make_default_relation_adapter(base_cls, relation, properties):
     header = ''.join([s.capitalize() for s in parts])
     name = "{}RelationAdapterModified".format(header)
     # and make the class
-    return type(name, (base_cls,), props)
+    cls = type(name, (base_cls,), props)
+    _default_adapter_classes[key] = cls
+    return cls
 
 
 class OpenStackRelationAdapters(object):
@@ -951,6 +1367,17 @@ class OpenStackRelationAdapters(object):
         for relation in self._relations:
             yield relation, getattr(self, relation)
 
+    def freeze(self):
+        """Return a read-only snapshot of this adapters instance.
+
+        Every accessor and property of the adapters (including the options) is
+        resolved at most once in the snapshot, so it can be passed as the
+        context to all of the templates in a render pass.
+
+        :returns: FrozenAdapter wrapping this adapters instance
+        """
+        return FrozenAdapter(self)
+
     def add_relations(self, relations):
         """Add the relations to this adapters instance for use as a context.
 
@@ -21,18 +21,23 @@ from __future__ import absolute_import
 import base64
 import collections
 import contextlib
+import copy
 import functools
+import glob
+import hashlib
 import itertools
 import os
 import random
 import re
+import socket
 import string
 import subprocess
+import threading
+import time
 
 import apt_pkg as apt
 import six
 
-import charmhelpers.contrib.network.ip as ch_ip
 import charmhelpers.contrib.openstack.templating as os_templating
 import charmhelpers.contrib.openstack.utils as os_utils
 import charmhelpers.core.hookenv as hookenv
@@ -55,6 +60,31 @@ import charms_openstack.os_release_data as os_release_data
 # `release` class property to indicate that it handles that release onwards.
 _releases = {}
 
+# `_release_dispatch` maps every known release to the class in `_releases`
+# that handles it, using the release order rather than alphabetical order.
+# It is rebuilt (by _get_release_dispatch()) whenever `_releases` or the
+# known releases change.
+_release_dispatch = {
+    'releases': None,
+    'size': 0,
+    'known': 0,
+    'table': {},
+    'first': None,
+    'latest': None,
+}
+
+# `_state_check_plans` holds the plans built by
+# OpenStackCharm.state_check_plan(), keyed by (class, required_relations).
+_state_check_plans = {}
+
+# `_install_planner` holds the InstallPlanner for this hook invocation.
+_install_planner = None
+
+# `_apt_cache` holds the apt cache opened by get_apt_cache(), which is shared
+# by the package version queries until the packages change.
+_apt_cache = None
+_apt_initialised = False
+
 # `_singleton` stores the instance of the class that is being used during a
 # hook invocation.
 _singleton = None
@@ -64,12 +94,34 @@ _singleton = None
 # This is to enable the defining code to define which release is used.
 _release_selector_function = None
 
+# `_default_release_selector` is the selector registered by the
+# 'charm.default-select-release' default handler, if it is in use.
+_default_release_selector = None
+
+# `_restart_scheduler` collects the service restarts requested during a hook
+# invocation so that they can be performed once, at the end of the hook.
+_restart_scheduler = None
+
 VIP_KEY = "vip"
 CIDR_KEY = "vip_cidr"
 IFACE_KEY = "vip_iface"
 APACHE_SSL_VHOST = '/etc/apache2/sites-available/openstack_https_frontend.conf'
 
 OPENSTACK_RELEASE_KEY = 'charmers.openstack-release-version'
+RELEASE_CLASS_KEY = 'charmers.openstack-release-class'
+APPLICATION_VERSION_KEY = 'charmers.openstack-application-version'
+APPLICATION_VERSION_SET_KEY = 'charmers.openstack-application-version-set'
+WORKLOAD_STATUS_KEY = 'charmers.openstack-workload-status'
+APT_SOURCE_KEY = 'charmers.openstack-apt-source'
+
+# The apt source lists; if any of these change then the package lists need to
+# be updated.
+APT_SOURCES_LIST = '/etc/apt/sources.list'
+APT_SOURCES_PARTS = '/etc/apt/sources.list.d/*.list'
+
+# dpkg rewrites this file whenever a package is installed, upgraded or
+# removed, so its mtime and size tell us whether the packages have changed.
+DPKG_STATUS = '/var/lib/dpkg/status'
 
 # handler support for default handlers
 
@@ -145,6 +197,7 @@ def make_default_install_handler():
         the charm author
         """
         unitdata.kv().unset(OPENSTACK_RELEASE_KEY)
+        invalidate_release_class()
         OpenStackCharm.singleton.install()
         reactive.set_state('charm.installed')
 
@@ -154,6 +207,7 @@ def make_default_select_release_handler():
     """This handler is a bit more unusual, as it just sets the release selector
     using the @register_os_release_selector decorator
     """
+    global _default_release_selector
 
     @register_os_release_selector
     def default_select_release():
@@ -170,6 +224,8 @@ def make_default_select_release_handler():
             unitdata.kv().set(OPENSTACK_RELEASE_KEY, release_version)
         return release_version
 
+    _default_release_selector = default_select_release
+
 
 @_map_default_handler('amqp.connected')
 def make_default_amqp_connection_handler():
@@ -343,9 +399,9 @@ def get_charm_instance(release=None, *args, **kwargs):
     """Get an instance of the charm based on the release (or use the
     default if release is None).
 
-    OS releases are in alphabetical order, so it looks for the first release
-    that is provided if release is None, otherwise it finds the release that is
-    before or equal to the release passed.
+    It uses the latest release that is provided if release is None, otherwise
+    it finds the class for the latest release that is before or equal to the
+    release passed, in OpenStack release order.
 
     Note that it passes args and kwargs to the class __init__() method.
 
@@ -354,35 +410,123 @@ def get_charm_instance(release=None, *args, **kwargs):
     """
     if len(_releases.keys()) == 0:
         raise RuntimeError("No derived OpenStackCharm() classes registered")
-    # Note that this relies on OS releases being in alphabetica order
-    known_releases = sorted(_releases.keys())
-    cls = None
+    dispatch = _get_release_dispatch()
     if release is None:
         # take the latest version of the charm if no release is passed.
-        cls = _releases[known_releases[-1]]
+        cls = dispatch['latest']
     else:
         # check that the release is a valid release
-        if release not in os_release_data.KNOWN_RELEASES:
+        if os_release_data.release_ordinal(release) is None:
             raise RuntimeError(
                 "Release {} is not a known OpenStack release?".format(release))
-        release_index = os_release_data.KNOWN_RELEASES.index(release)
-        if (release_index <
-                os_release_data.KNOWN_RELEASES.index(known_releases[0])):
+        cls = dispatch['table'].get(release)
+        if cls is None:
             raise RuntimeError(
                 "Release {} is not supported by this charm. Earliest support "
-                "is {} release".format(release, known_releases[0]))
-        else:
-            # try to find the release that is supported.
-            for known_release in reversed(known_releases):
-                if (release_index >=
-                        os_release_data.KNOWN_RELEASES.index(known_release)):
-                    cls = _releases[known_release]
-                    break
-    if cls is None:
-        raise RuntimeError("Release {} is not supported".format(release))
+                "is {} release".format(release, dispatch['first']))
     return cls(release=release, *args, **kwargs)
 
 
+def _get_release_dispatch():
+    """Return the release dispatch table for the classes in `_releases`,
+    building it if `_releases` has changed since it was last built.
+
+    :returns: dictionary with 'table' (release -> class, for every known
+        release that has a handler), 'first' (the earliest release handled)
+        and 'latest' (the class for the latest release).
+    """
+    global _release_dispatch
+    if (_release_dispatch['releases'] is not _releases or
+            _release_dispatch['size'] != len(_releases) or
+            _release_dispatch['known'] != len(os_release_data.KNOWN_RELEASES)):
+        table = {}
+        cls = None
+        for release in os_release_data.KNOWN_RELEASES:
+            cls = _releases.get(release, cls)
+            if cls is not None:
+                table[release] = cls
+        ordered = sorted(_releases.keys(),
+                         key=os_release_data.RELEASE_ORDINALS.get)
+        _release_dispatch = {
+            'releases': _releases,
+            'size': len(_releases),
+            'known': len(os_release_data.KNOWN_RELEASES),
+            'table': table,
+            'first': ordered[0] if ordered else None,
+            'latest': _releases[ordered[-1]] if ordered else None,
+        }
+    return _release_dispatch
+
+
+def _release_class_fingerprint():
+    """Return a fingerprint of what the release selection depends on: the
+    installed packages and the openstack-origin config option.
+
+    :returns: list or None if the packages can't be fingerprinted.
+    """
+    fingerprint = dpkg_status_fingerprint()
+    if fingerprint is None:
+        return None
+    return fingerprint + [hookenv.config().get('openstack-origin')]
+
+
+def _release_class_cacheable():
+    """Return whether the release and class can be persisted between hooks.
+    A custom release selector may depend on anything, so it is always run.
+
+    :returns: boolean
+    """
+    return _release_selector_function in (None, _default_release_selector)
+
+
+def _cache_release_class(release, charm_cls):
+    """Persist the release and the name of the class chosen for it, so that
+    later hooks can skip the release selection.
+
+    :param release: the release passed to get_charm_instance()
+    :param charm_cls: the OpenStackCharm() derived class that was chosen
+    """
+    fingerprint = _release_class_fingerprint()
+    if fingerprint is None:
+        return
+    unitdata.kv().set(RELEASE_CLASS_KEY, {
+        'release': release,
+        'class': charm_cls.__name__,
+        'fingerprint': fingerprint,
+    })
+
+
+def _get_cached_release_class():
+    """Return the release and class persisted by _cache_release_class(),
+    unless the fingerprint has changed or the class is no longer the one
+    that handles the release.
+
+    :returns: (release, class) or None
+    """
+    cached = unitdata.kv().get(RELEASE_CLASS_KEY, None)
+    if not isinstance(cached, dict) or not _releases:
+        return None
+    fingerprint = _release_class_fingerprint()
+    if fingerprint is None or cached.get('fingerprint') != fingerprint:
+        return None
+    dispatch = _get_release_dispatch()
+    release = cached.get('release')
+    if release is None:
+        charm_cls = dispatch['latest']
+    else:
+        charm_cls = dispatch['table'].get(release)
+    if charm_cls is None or charm_cls.__name__ != cached.get('class'):
+        return None
+    return release, charm_cls
+
+
+def invalidate_release_class():
+    """Forget the persisted release and class, e.g. after the packages have
+    changed, so that the next hook runs the release selection again.
+    """
+    unitdata.kv().unset(RELEASE_CLASS_KEY)
+
+
 def register_os_release_selector(f):
     """Register a function that determines what the release is for the
     invocation run.  This allows the charm to define HOW the release is
@@ -407,6 +551,333 @@ def register_os_release_selector(f):
     return f
 
 
+class RestartScheduler(object):
+    """Collect the service restarts requested during a hook invocation and
+    perform them together.
+
+    Restart requests are deduplicated; a service is only restarted once per
+    flush however many times it was requested.  A request can also ask for
+    a 'reload' or a custom command (a list of arguments) rather than a
+    'restart'; when a service has several requests, the cheapest action
+    that satisfies all of them is used.  The optional dependencies
+    map a service to the services that it depends on, e.g.
+
+        {'nova-api': ['nova-conductor']}
+
+    and are used to stop dependent services before the services they depend
+    on and to start them afterwards.  Services that don't depend on each
+    other are stopped/started in parallel.
+    """
+
+    def __init__(self):
+        self._pending = collections.OrderedDict()
+        self._dependencies = {}
+
+    @property
+    def pending(self):
+        """Return the list of services waiting to be restarted"""
+        return list(self._pending.keys())
+
+    def schedule(self, services, dependencies=None, action='restart'):
+        """Add the services to the list of services to restart.
+
+        :param services: list of service names
+        :param dependencies: [optional] dictionary of service -> list of
+            services that the service depends on.
+        :param action: 'restart', 'reload' or a custom command as a list.
+        :raises: ValueError if the action isn't recognised.
+        """
+        if isinstance(action, six.string_types):
+            if action not in ('restart', 'reload'):
+                raise ValueError("Unknown restart action: {}".format(action))
+        else:
+            action = tuple(action)
+        for service in services:
+            self._pending.setdefault(service, set()).add(action)
+        for service, deps in (dependencies or {}).items():
+            self._dependencies.setdefault(service, [])
+            for dep in deps:
+                if dep not in self._dependencies[service]:
+                    self._dependencies[service].append(dep)
+
+    def action(self, service):
+        """Return the cheapest action that satisfies all of the requests for
+        the service.
+
+        A restart satisfies everything, and a custom command is assumed to
+        cover a reload; two different custom commands need a restart.
+
+        :param service: the name of a pending service
+        :returns: 'restart', 'reload' or a tuple for a custom command
+        """
+        actions = self._pending[service]
+        commands = [a for a in actions if isinstance(a, tuple)]
+        if 'restart' in actions or len(commands) > 1:
+            return 'restart'
+        if commands:
+            return commands[0]
+        return 'reload'
+
+    def levels(self):
+        """Return the pending services grouped into lists of mutually
+        independent services, in start order.
+
+        A dependency cycle can't be ordered, so the services on it are placed
+        together in the last level.
+
+        :returns: list of lists of service names
+        """
+        services = self.pending
+        remaining = list(services)
+        done = set()
+        levels = []
+        while remaining:
+            level = [s for s in remaining
+                     if all(d in done or d not in services or d == s
+                            for d in self._dependencies.get(s, []))]
+            if not level:
+                level = remaining
+            levels.append(level)
+            done.update(level)
+            remaining = [s for s in remaining if s not in done]
+        return levels
+
+    def flush(self):
+        """Restart all of the pending services and clear the list.
+
+        Services being restarted are stopped, dependents first, and then all
+        of the services are started, reloaded or have their command run in
+        dependency order.
+        """
+        levels = self.levels()
+        actions = {service: self.action(service) for service in self.pending}
+        self._pending.clear()
+        for level in reversed(levels):
+            self._run_parallel(
+                ch_host.service_stop,
+                [s for s in level if actions[s] == 'restart'])
+        for level in levels:
+            self._run_parallel(
+                functools.partial(self._apply, actions), level)
+
+    @staticmethod
+    def _apply(actions, service):
+        """Bring up the service using the action decided for it."""
+        action = actions[service]
+        if action == 'restart':
+            ch_host.service_start(service)
+        elif action == 'reload':
+            ch_host.service_reload(service, restart_on_failure=True)
+        else:
+            subprocess.check_call(list(action))
+
+    @staticmethod
+    def _run_parallel(f, services):
+        """Call f(service) for each of the services, concurrently if there is
+        more than one.  The first exception raised (if any) is re-raised once
+        all the calls have completed.
+        """
+        if len(services) < 2:
+            for service in services:
+                f(service)
+            return
+        errors = []
+
+        def _call(service):
+            try:
+                f(service)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=_call, args=(service, ))
+                   for service in services]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+
+class InstallPlanner(object):
+    """Track the package operations done during a hook invocation, so that
+    the installation source is configured (and apt_update run) at most once
+    per source, and packages that are already installed aren't looked up or
+    installed again.
+
+    The install paths (install(), setup_token_cache(), configure_apache())
+    all ask the planner for the missing packages, so once the charm's
+    packages have been installed in one apt transaction the later paths
+    don't run apt at all.
+    """
+
+    def __init__(self):
+        self.source = None
+        self.installed = set()
+
+    def configure_source(self, source, max_age=None, fatal=True):
+        """Configure the installation source and update the package lists,
+        unless that has already been done for this source.
+
+        The source, a digest of the apt source lists and the time of the
+        update are kept in unitdata.  If max_age is given, a later hook with
+        the same source and source lists skips the update until max_age
+        seconds have passed.  Skipping doesn't count as having done the update
+        for this hook, so a later call with max_age=None still updates.
+
+        :param source: the installation source, e.g. 'cloud:xenial-ocata'
+        :param max_age: seconds for which the package lists stay fresh, or
+            None to always update them.
+        :param fatal: passed to fetch.apt_update()
+        """
+        if source == self.source:
+            return
+        kv = unitdata.kv()
+        last = kv.get(APT_SOURCE_KEY, None)
+        if (max_age is not None and isinstance(last, dict) and
+                last.get('source') == source and
+                last.get('digest') == apt_sources_digest() and
+                time.time() - last.get('timestamp', 0) < max_age):
+            return
+        os_utils.configure_installation_source(source)
+        fetch.apt_update(fatal=fatal)
+        invalidate_apt_cache()
+        self.source = source
+        kv.set(APT_SOURCE_KEY, {
+            'source': source,
+            'digest': apt_sources_digest(),
+            'timestamp': time.time(),
+        })
+
+    def missing_packages(self, packages):
+        """Return the packages that aren't installed yet.
+
+        :param packages: list of package names
+        :returns: list of the package names that need to be installed
+        """
+        candidates = [p for p in packages if p not in self.installed]
+        if not candidates:
+            return []
+        missing = fetch.filter_installed_packages(candidates) or []
+        self.installed.update(set(candidates).difference(missing))
+        return missing
+
+    def install(self, packages, **kwargs):
+        """Install the packages in one apt transaction and remember them.
+
+        :param packages: list of package names
+        :param kwargs: passed to fetch.apt_install()
+        """
+        kwargs.setdefault('fatal', True)
+        fetch.apt_install(packages=packages, **kwargs)
+        invalidate_apt_cache()
+        invalidate_release_class()
+        self.installed.update(packages)
+
+
+def get_install_planner():
+    """Return the InstallPlanner for this hook invocation, creating it if
+    needed.
+    """
+    global _install_planner
+    if _install_planner is None:
+        _install_planner = InstallPlanner()
+    return _install_planner
+
+
+def get_restart_scheduler():
+    """Return the RestartScheduler for this hook invocation, creating it if
+    needed.
+
+    The charm methods that schedule restarts also flush them (see
+    flush_restarts()) before they return.  Flushing at the end of a
+    successful hook is only a backstop for restarts scheduled directly with
+    schedule_restart(), as atexit callbacks aren't run if the hook fails or
+    outside of charms.reactive (e.g. in actions).
+
+    :returns: RestartScheduler instance
+    """
+    global _restart_scheduler
+    if _restart_scheduler is None:
+        _restart_scheduler = RestartScheduler()
+        hookenv.atexit(flush_restarts)
+    return _restart_scheduler
+
+
+def flush_restarts():
+    """Perform any restarts that have been scheduled in this hook invocation.
+
+    This is called at the end of each render pass (restart_on_change()), by
+    restart_all() and after an upgrade's configs are rendered, and at the end
+    of a successful hook for anything still pending.
+    """
+    if _restart_scheduler is not None:
+        _restart_scheduler.flush()
+
+
+def get_apt_cache():
+    """Return the apt cache shared by the package version queries in this
+    process, opening it the first time that it is needed.
+
+    The cache is a snapshot of the package state, so it is discarded (by
+    invalidate_apt_cache()) after packages are installed or upgraded or the
+    package lists are updated.
+    """
+    global _apt_cache
+    if _apt_cache is None:
+        init_apt()
+        _apt_cache = fetch.apt_cache()
+    return _apt_cache
+
+
+def init_apt():
+    """Initialise apt_pkg, once per process."""
+    global _apt_initialised
+    if not _apt_initialised:
+        apt.init()
+        _apt_initialised = True
+
+
+def invalidate_apt_cache():
+    """Discard the apt cache returned by get_apt_cache(), so that the next
+    query sees the packages as they are now.
+    """
+    global _apt_cache
+    _apt_cache = None
+
+
+def status_set(state, message):
+    """Set the workload status and record it in unitdata.
+
+    Charm code should set the status with this rather than with
+    hookenv.status_set(), so that assess_status() can tell whether the status
+    needs setting again in update-status hooks.
+
+    :param state: the workload state, e.g. 'active'
+    :param message: the status message
+    """
+    hookenv.status_set(state, message)
+    unitdata.kv().set(WORKLOAD_STATUS_KEY, [state, message])
+
+
+def cached_per_hook(f):
+    """Memoize the result of a charm instance method, which takes no
+    arguments, for the lifetime of the instance (i.e. the hook invocation).
+
+    Each caller gets its own copy of the result, so it can be modified
+    without affecting the cache.  The cache is cleared by
+    OpenStackCharm.invalidate_cache(), which is called when reactive states
+    are set or removed through the charm.
+    """
+    @functools.wraps(f)
+    def wrapper(self):
+        cache = self.__dict__.setdefault('_hook_cache', {})
+        if f not in cache:
+            cache[f] = f(self)
+        return copy.deepcopy(cache[f])
+    return wrapper
+
+
 class OpenStackCharmMeta(type):
     """Metaclass to provide a classproperty of 'singleton' so that class
     methods in the derived OpenStackCharm() class can simply use cls.singleton
@@ -445,7 +916,7 @@ class OpenStackCharmMeta(type):
             return
         if 'release' in members.keys():
             release = members['release']
-            if release not in os_release_data.KNOWN_RELEASES:
+            if release not in os_release_data.RELEASE_ORDINALS:
                 raise RuntimeError(
                     "Release {} is not a known OpenStack release"
                     .format(release))
@@ -456,6 +927,7 @@ class OpenStackCharmMeta(type):
                     .format(release, _releases[release].__name__, name))
             # store the class against the release.
             _releases[release] = cls
+            _get_release_dispatch()
         else:
             raise RuntimeError(
                 "class '{}' does not define a release that it supports. "
@@ -471,11 +943,21 @@ class OpenStackCharmMeta(type):
         """
         global _singleton
         if _singleton is None:
+            # use the release and class resolved in an earlier hook, if
+            # nothing that they depend on has changed.
+            cacheable = _release_class_cacheable()
+            cached = _get_cached_release_class() if cacheable else None
+            if cached is not None:
+                release, charm_cls = cached
+                _singleton = charm_cls(release=release)
+                return _singleton
             release = None
             # see if a _release_selector_function has been registered.
             if _release_selector_function is not None:
                 release = _release_selector_function()
             _singleton = get_charm_instance(release=release)
+            if cacheable:
+                _cache_release_class(release, _singleton.__class__)
         return _singleton
 
 
@@ -535,6 +1017,23 @@ class OpenStackCharm(object):
     # The list of services that this charm manages
     services = []
 
+    # A dictionary of service -> list of services that it depends on; used to
+    # order restarts, e.g.
+    # {
+    #    'service-api': ['service-scheduler'],
+    # }
+    restart_dependencies = {}
+
+    # A dictionary of service or config file -> action, used to apply a
+    # change with something cheaper than a restart.  The action is one of
+    # 'restart' (the default), 'reload' or a custom command as a list; an
+    # entry for a config file takes precedence over one for a service, e.g.
+    # {
+    #    'service': 'reload',
+    #    '/etc/service/policy.json': ['service-ctl', 'refresh-policy'],
+    # }
+    restart_actions = {}
+
     # The adapters class that this charm uses to adapt interfaces.
     # If None, then it defaults to OpenstackRelationsAdapter
     adapters_class = os_adapters.OpenStackRelationAdapters
@@ -548,6 +1047,15 @@ class OpenStackCharm(object):
     MEMCACHE_CONF = '/etc/memcached.conf'
     package_codenames = {}
 
+    # Seconds to wait for a connection when probing whether a port is open
+    # during assess_status()
+    port_probe_timeout = 1.0
+
+    # Seconds for which the package lists are considered fresh enough that
+    # configure_source() can skip apt_update, if the installation source and
+    # apt source lists haven't changed.  None means always update.
+    apt_update_interval = 60 * 60
+
     @property
     def singleton(self):
         """Return the only instance of the charm class in this run"""
@@ -602,6 +1110,7 @@ class OpenStackCharm(object):
         return self.__options
 
     @property
+    @cached_per_hook
     def all_packages(self):
         """List of packages to be installed
 
@@ -610,6 +1119,7 @@ class OpenStackCharm(object):
         return self.packages
 
     @property
+    @cached_per_hook
     def full_restart_map(self):
         """Map of services to be restarted if a file changes
 
@@ -625,24 +1135,36 @@ class OpenStackCharm(object):
         """Install packages related to this charm based on
         contents of self.packages attribute.
         """
-        packages = fetch.filter_installed_packages(
-            self.all_packages)
+        planner = get_install_planner()
+        packages = planner.missing_packages(self.all_packages)
         if packages:
-            hookenv.status_set('maintenance', 'Installing packages')
-            fetch.apt_install(packages, fatal=True)
+            status_set('maintenance', 'Installing packages')
+            planner.install(packages)
         # AJK: we set this as charms can use it to detect installed state
         self.set_state('{}-installed'.format(self.name))
         self.update_api_ports()
-        hookenv.status_set('maintenance',
-                           'Installation complete - awaiting next status')
+        status_set('maintenance',
+                   'Installation complete - awaiting next status')
 
     def set_state(self, state, value=None):
         """proxy for charms.reactive.bus.set_state()"""
         reactive.bus.set_state(state, value)
+        self.invalidate_cache()
 
     def remove_state(self, state):
         """proxy for charms.reactive.bus.remove_state()"""
         reactive.bus.remove_state(state)
+        self.invalidate_cache()
+
+    def invalidate_cache(self):
+        """Discard the values memoized by @cached_per_hook methods, e.g.
+        after changing config or state that they depend on.
+
+        The addresses cached by os_ip.resolve_address() are kept, as they
+        don't depend on the reactive states; code that changes the network
+        configuration should call os_ip.flush_address_cache() itself.
+        """
+        self.__dict__.pop('_hook_cache', None)
 
     def get_state(self, state):
         """proxy for charms.reactive.bus.get_state()"""
@@ -679,25 +1201,40 @@ class OpenStackCharm(object):
         """
         return self.api_ports[service][endpoint_type]
 
-    def update_api_ports(self, ports=None):
+    def update_api_ports(self, ports=None, protocol='tcp'):
         """Update the ports list supplied (or the default ports defined in the
         classes' api_ports member) using the juju helper.
 
         It takes the opened-ports from Juju, checks them against the ports
         provided.  If a port is already open, then it doesn't try to open it,
         if it is closed, but should be open, then it opens it, and vice-versa.
-
-        :param ports: List of api port numbers or None.
-        """
-        ports = list(map(int, (
-            ports or self._default_port_list(self.api_ports or {}))))
-        current_ports = list(map(int, self.opened_ports()))
-        ports_to_open = set(ports).difference(current_ports)
-        ports_to_close = set(current_ports).difference(ports)
-        for p in ports_to_open:
-            hookenv.open_port(p)
-        for p in ports_to_close:
-            hookenv.close_port(p)
+        Only opened ports with the protocols being reconciled are considered.
+
+        Contiguous ports are opened as a single range.  An opened range that
+        contains a port that shouldn't be open is closed, and its wanted ports
+        are re-opened.  Ports are closed before any are opened.  If Juju's
+        opened ports already match, no ports are opened or closed.
+
+        :param ports: List of api ports or None.  Each is a port number, or a
+            string of the form '<port>[-<port>][/<protocol>]'
+        :param protocol: the protocol for the ports that don't specify one.
+        """
+        wanted = set()
+        for spec in ports or self._default_port_list(self.api_ports or {}):
+            wanted.update(parse_port_spec(spec, protocol))
+        protocols = {protocol.lower()}.union(p for _, p in wanted)
+        covered = set()
+        for spec in self.opened_ports(protocol=None):
+            opened = parse_port_spec(spec)
+            port_range, port_protocol = spec.split('/')
+            if port_protocol.lower() not in protocols:
+                continue
+            if opened.issubset(wanted):
+                covered.update(opened)
+            else:
+                hookenv.close_port(port_range, port_protocol.upper())
+        for port_range, port_protocol in compress_ports(wanted - covered):
+            hookenv.open_port(port_range, port_protocol.upper())
 
     @staticmethod
     def opened_ports(protocol="tcp"):
@@ -733,10 +1270,13 @@ class OpenStackCharm(object):
         'openstack-origin'
 
         This configures the installation source for deb packages and then
-        updates the packages list on the unit.
+        updates the packages list on the unit, unless that has already been
+        done for this source during the hook, or in the last
+        self.apt_update_interval seconds with the same apt source lists.
         """
-        os_utils.configure_installation_source(self.config['openstack-origin'])
-        fetch.apt_update(fatal=True)
+        get_install_planner().configure_source(
+            self.config['openstack-origin'],
+            max_age=self.apt_update_interval)
 
     @property
     def region(self):
@@ -778,11 +1318,25 @@ class OpenStackCharm(object):
         """
         if not self.version_package:
             self.version_package = self.packages[0]
+        # the version only changes when the packages do, so it is kept in
+        # unitdata against the dpkg status fingerprint.
+        fingerprint = dpkg_status_fingerprint()
+        cached = unitdata.kv().get(APPLICATION_VERSION_KEY, None)
+        if (fingerprint is not None and isinstance(cached, dict) and
+                cached.get('package') == self.version_package and
+                cached.get('fingerprint') == fingerprint):
+            return cached['version']
         version = get_upstream_version(
             self.version_package
         )
         if not version:
             version = os_utils.os_release(self.version_package)
+        if fingerprint is not None:
+            unitdata.kv().set(APPLICATION_VERSION_KEY, {
+                'package': self.version_package,
+                'fingerprint': fingerprint,
+                'version': version,
+            })
         return version
 
     @contextlib.contextmanager
@@ -793,20 +1347,54 @@ class OpenStackCharm(object):
         This function is a @decorator that checks if the wrapped function
         changes any of the files identified by the keys in the
         self.restart_map{} and, if they change, restarts the services in the
-        corresponding list.
+        corresponding list.  The restarts are deduplicated across the pass, and
+        done when the outermost restart_on_change() exits, so that a later
+        failure in the hook can't lose them.
         """
+        # full_restart_map hands out a copy, so only fetch it once.
+        restart_map = self.full_restart_map
         checksums = {path: ch_host.path_hash(path)
-                     for path in self.full_restart_map.keys()}
-        yield
-        restarts = []
-        for path in self.full_restart_map:
+                     for path in restart_map.keys()}
+        self._restart_on_change_depth = self.__dict__.get(
+            '_restart_on_change_depth', 0) + 1
+        try:
+            yield
+        finally:
+            self._restart_on_change_depth -= 1
+        for path, services in six.iteritems(restart_map):
             if ch_host.path_hash(path) != checksums[path]:
-                restarts += self.full_restart_map[path]
-        services_list = list(collections.OrderedDict.fromkeys(restarts).keys())
-        for service_name in services_list:
-            ch_host.service_stop(service_name)
-        for service_name in services_list:
-            ch_host.service_start(service_name)
+                for service in services:
+                    self.schedule_restart(
+                        [service], action=self.restart_action(service, path))
+        if not self._restart_on_change_depth:
+            flush_restarts()
+
+    def restart_action(self, service, path=None):
+        """Return the action to take on the service when path changes, as
+        configured in the self.restart_actions{} attribute.
+
+        :param service: the name of the service
+        :param path: [optional] the config file that changed
+        :returns: 'restart', 'reload' or a list for a custom command
+        """
+        if path in self.restart_actions:
+            return self.restart_actions[path]
+        return self.restart_actions.get(service, 'restart')
+
+    def schedule_restart(self, services, action='restart'):
+        """Schedule the services to be restarted at the next flush_restarts().
+
+        Repeated requests for the same service before the flush result in a
+        single restart (or the cheapest action that satisfies all of the
+        requests).  Callers should call flush_restarts() once they have
+        scheduled everything; anything left is flushed at the end of a
+        successful hook.
+
+        :param services: list of service names
+        :param action: 'restart', 'reload' or a custom command as a list.
+        """
+        get_restart_scheduler().schedule(
+            services, dependencies=self.restart_dependencies, action=action)
 
     def render_all_configs(self, adapters_instance=None):
         """Render (write) all of the config files identified as the keys in the
@@ -844,6 +1432,12 @@ class OpenStackCharm(object):
         """
         if adapters_instance is None:
             adapters_instance = self.adapters_instance
+        # resolve the adapters' values just once for all of the templates in
+        # this pass, rather than once per template.
+        context = adapters_instance
+        if isinstance(adapters_instance,
+                      os_adapters.OpenStackRelationAdapters):
+            context = adapters_instance.freeze()
         with self.restart_on_change():
             for conf in configs:
                 charmhelpers.core.templating.render(
@@ -851,7 +1445,7 @@ class OpenStackCharm(object):
                     template_loader=os_templating.get_loader(
                         'templates/', self.release),
                     target=conf,
-                    context=adapters_instance)
+                    context=context)
 
     def render_with_interfaces(self, interfaces, configs=None):
         """Render the configs using the interfaces passed; overrides any
@@ -872,13 +1466,14 @@ class OpenStackCharm(object):
             self.render_configs(
                 configs,
                 adapters_instance=self.adapters_class(interfaces))
+        flush_restarts()
 
     def restart_all(self):
         """Restart all the services configured in the self.services[]
-        attribute.
+        attribute, along with any restarts already scheduled.
         """
-        for svc in self.services:
-            ch_host.service_restart(svc)
+        self.schedule_restart(self.services)
+        flush_restarts()
 
     def db_sync_done(self):
         return hookenv.leader_get(attribute='db-sync-done')
@@ -926,19 +1521,74 @@ class OpenStackCharm(object):
 
         SIDE EFFECT: this function calls status_set(state, message) to set the
         workload status in juju and calls application_version_set(vers) to set
-        the application version in juju.
-        """
-        hookenv.application_version_set(self.application_version)
-        for f in [self.check_if_paused,
-                  self.custom_assess_status_check,
-                  self.check_interfaces,
-                  self.check_services_running]:
-            state, message = f()
-            if state is not None:
-                hookenv.status_set(state, message)
-                return
+        the application version in juju, if it has changed since it was last
+        set.
+        """
+        version = self.application_version
+        if version != unitdata.kv().get(APPLICATION_VERSION_SET_KEY, None):
+            hookenv.application_version_set(version)
+            unitdata.kv().set(APPLICATION_VERSION_SET_KEY, version)
+        # the service and port probes are shared by the checks for this call
+        self._assess_probes = {}
+        try:
+            for f in [self.check_if_paused,
+                      self.custom_assess_status_check,
+                      self.check_interfaces,
+                      self.check_services_running]:
+                state, message = f()
+                if state is not None:
+                    self._status_set(state, message)
+                    return
+        finally:
+            self._assess_probes = None
         # No state was particularly set, so assume the unit is active
-        hookenv.status_set('active', 'Unit is ready')
+        self._status_set('active', 'Unit is ready')
+
+    def _status_set(self, state, message):
+        """Set the workload status, unless this is an update-status hook and
+        it is the status last set by status_set().  The check uses the status
+        recorded in unitdata, so it doesn't need a status-get call.
+        """
+        if (hookenv.hook_name() == 'update-status' and
+                unitdata.kv().get(WORKLOAD_STATUS_KEY, None) ==
+                [state, message]):
+            return
+        status_set(state, message)
+
+    def probe_services_and_ports(self):
+        """Check whether each of self.services is running and whether each of
+        the ports from ports_to_check(self.api_ports) is open.  The ports are
+        probed concurrently, with a timeout of self.port_probe_timeout.
+
+        During assess_status() the probes are only done once, and the results
+        are shared by the checks.
+
+        :returns: ([(service, running), ...], [(port, open), ...])
+        """
+        probes = getattr(self, '_assess_probes', None)
+        if probes and 'results' in probes:
+            return probes['results']
+        services = [(service, bool(ch_host.service_running(service)))
+                    for service in self.services or []]
+        ports = self._assess_ports()
+        open_ports = probe_ports(ports, timeout=self.port_probe_timeout)
+        results = (services, [(port, port in open_ports) for port in ports])
+        if probes is not None:
+            probes['results'] = results
+        return results
+
+    def _assess_ports(self):
+        """Return ports_to_check(self.api_ports), which is only worked out
+        once during assess_status().
+
+        :returns: [port, ...]
+        """
+        probes = getattr(self, '_assess_probes', None)
+        if probes is None:
+            return self.ports_to_check(self.api_ports)
+        if 'ports' not in probes:
+            probes['ports'] = self.ports_to_check(self.api_ports)
+        return probes['ports']
 
     def custom_assess_status_check(self):
         """Override this function in a derived class if there are any other
@@ -963,7 +1613,7 @@ class OpenStackCharm(object):
         """
         return os_utils._ows_check_if_paused(
             services=self.services,
-            ports=self.ports_to_check(self.api_ports))
+            ports=self._assess_ports())
 
     def check_interfaces(self):
         """Check that the required interfaces have both connected and availble
@@ -987,25 +1637,41 @@ class OpenStackCharm(object):
 
         :returns (status, message) or (None, None)
         """
-        states_to_check = self.states_to_check()
+        plan = self.state_check_plan()
         # bail if there is nothing to do.
-        if not states_to_check:
+        if not plan:
             return None, None
-        available_states = reactive.bus.get_states().keys()
-        status = None
-        messages = []
-        for relation, states in six.iteritems(states_to_check):
-            for state, err_status, err_msg in states:
-                if state not in available_states:
-                    messages.append(err_msg)
-                    status = os_utils.workload_state_compare(status,
-                                                             err_status)
-                    # as soon as we error on a relation, skip to the next one.
-                    break
-        if status is not None:
-            return status, ", ".join(messages)
-        # Everything is fine.
-        return None, None
+        available_states = set(reactive.bus.get_states().keys())
+        return evaluate_state_check_plan(plan, available_states)
+
+    def state_check_plan(self):
+        """Return the states that check_interfaces() checks, as built by
+        states_to_check(), in a form that can be evaluated against a set of
+        states by evaluate_state_check_plan().
+
+        The plan for the default states_to_check() only depends on the class
+        and its required_relations, so it is built once for each of those.
+        If states_to_check() is overridden, the plan is built once per hook.
+
+        :returns: ((relation, ((state, err_status, err_msg), ...)), ...)
+        """
+        states_to_check = six.get_unbound_function(type(self).states_to_check)
+        if ('states_to_check' not in self.__dict__ and
+                states_to_check is six.get_unbound_function(
+                    OpenStackCharm.states_to_check)):
+            cache = _state_check_plans
+            key = (type(self), tuple(self.required_relations))
+        else:
+            cache = self.__dict__.setdefault('_hook_cache', {})
+            key = OpenStackCharm.state_check_plan
+        try:
+            return cache[key]
+        except KeyError:
+            plan = tuple((relation, tuple(tuple(check) for check in states))
+                         for relation, states in
+                         six.iteritems(self.states_to_check()))
+            cache[key] = plan
+            return plan
 
     def states_to_check(self, required_relations=None):
         """Construct a default set of connected and available states for each
@@ -1043,13 +1709,19 @@ class OpenStackCharm(object):
         This uses the self.services and self.api_ports to determine what should
         be checked.
 
+        The services and ports are probed by probe_services_and_ports(); only
+        if something is down is charmhelpers asked for the status message.
+
         :returns: (status, message) or (None, None).
         """
-        # This returns either a None, None or a status, message if the service
-        # is not running or the ports are not open.
+        services, ports = self.probe_services_and_ports()
+        if all(up for _, up in services) and all(up for _, up in ports):
+            return None, None
+        # This returns a status, message for the services that are not
+        # running or the ports that are not open.
         return os_utils._ows_check_services_running(
             services=self.services,
-            ports=self.ports_to_check(self.api_ports))
+            ports=self._assess_ports())
 
     def upgrade_charm(self):
         """Called (at least) by the default handler (if that is used).  This
@@ -1101,7 +1773,7 @@ class OpenStackCharm(object):
         :param fatal: bool Raise exception if pkg not installed
         :returns: str OpenStack version name corresponding to package
         """
-        cache = fetch.apt_cache()
+        cache = get_apt_cache()
 
         try:
             pkg = cache[package]
@@ -1138,16 +1810,13 @@ class OpenStackCharm(object):
         :param fatal: bool Raise exception if pkg not installed
         :returns: str OpenStack version number corresponding to package
         """
-        codenames = self.package_codenames or os_utils.PACKAGE_CODENAMES
+        codenames = (self.package_codenames or
+                     os_release_data.get_package_codenames())
         codename = self.get_os_codename_package(
             package, codenames, fatal=fatal)
         if not codename:
             return None
-
-        vers_map = os_utils.OPENSTACK_CODENAMES
-        for version, cname in six.iteritems(vers_map):
-            if cname == codename:
-                return version
+        return os_release_data.release_version(codename)
 
     def openstack_upgrade_available(self, package=None):
         """Check if an OpenStack upgrade is available
@@ -1161,7 +1830,7 @@ class OpenStackCharm(object):
         src = self.config['openstack-origin']
         cur_vers = self.get_os_version_package(package)
         avail_vers = os_utils.get_os_version_install_source(src)
-        apt.init()
+        init_apt()
         return apt.version_compare(avail_vers, cur_vers) == 1
 
     def upgrade_if_available(self, interfaces_list):
@@ -1171,9 +1840,12 @@ class OpenStackCharm(object):
         :returns: None
         """
         if self.openstack_upgrade_available(self.release_pkg):
-            hookenv.status_set('maintenance', 'Running openstack upgrade')
+            status_set('maintenance', 'Running openstack upgrade')
             self.do_openstack_pkg_upgrade()
             self.do_openstack_upgrade_config_render(interfaces_list)
+            # the services must be running on the new config before the
+            # database is migrated.
+            flush_restarts()
             self.do_openstack_upgrade_db_migration()
 
     def do_openstack_pkg_upgrade(self):
@@ -1182,11 +1854,13 @@ class OpenStackCharm(object):
         :returns: None
         """
         new_src = self.config['openstack-origin']
-        new_os_rel = os_utils.get_os_codename_install_source(new_src)
+        os_release_data.flush_release_cache()
+        new_os_rel = os_release_data.get_os_codename_install_source(new_src)
         hookenv.log('Performing OpenStack upgrade to %s.' % (new_os_rel))
 
-        os_utils.configure_installation_source(new_src)
-        fetch.apt_update()
+        planner = get_install_planner()
+        # an upgrade always refreshes the package lists
+        planner.configure_source(new_src, max_age=None, fatal=False)
 
         dpkg_opts = [
             '--option', 'Dpkg::Options::=--force-confnew',
@@ -1196,10 +1870,7 @@ class OpenStackCharm(object):
             options=dpkg_opts,
             fatal=True,
             dist=True)
-        fetch.apt_install(
-            packages=self.all_packages,
-            options=dpkg_opts,
-            fatal=True)
+        planner.install(self.all_packages, options=dpkg_opts)
         self.release = new_os_rel
 
     def do_openstack_upgrade_config_render(self, interfaces_list):
@@ -1248,7 +1919,7 @@ class OpenStackAPICharm(OpenStackCharm):
 
     def setup_token_cache(self):
         """Check if a token cache package is needed and install it if it is"""
-        if fetch.filter_installed_packages(self.token_cache_pkgs()):
+        if get_install_planner().missing_packages(self.token_cache_pkgs()):
             self.install()
 
     def enable_memcache(self, release=None):
@@ -1258,12 +1929,12 @@ class OpenStackAPICharm(OpenStackCharm):
         @returns boolean Whether memcache should be enabled
         """
         if not release:
-            release = os_utils.get_os_codename_install_source(
+            release = os_release_data.get_os_codename_install_source(
                 self.config['openstack-origin'])
-        if release not in os_release_data.KNOWN_RELEASES:
+        ordinal = os_release_data.release_ordinal(release)
+        if ordinal is None:
             return ValueError("Unkown release {}".format(release))
-        return (os_release_data.KNOWN_RELEASES.index(release) >=
-                os_release_data.KNOWN_RELEASES.index('mitaka'))
+        return ordinal >= os_release_data.RELEASE_ORDINALS['mitaka']
 
     def token_cache_pkgs(self, release=None):
         """Determine additional packages needed for token caching
@@ -1315,6 +1986,7 @@ class OpenStackAPICharm(OpenStackCharm):
             "class")
 
     @property
+    @cached_per_hook
     def all_packages(self):
         """List of packages to be installed
 
@@ -1324,6 +1996,7 @@ class OpenStackAPICharm(OpenStackCharm):
                 self.token_cache_pkgs())
 
     @property
+    @cached_per_hook
     def full_restart_map(self):
         """Map of services to be restarted if a file changes
 
@@ -1343,6 +2016,13 @@ class HAOpenStackCharm(OpenStackAPICharm):
 
     abstract_class = True
 
+    # haproxy and apache2 can pick up configuration changes with a graceful
+    # reload, without dropping in-flight requests.
+    restart_actions = {
+        'haproxy': 'reload',
+        'apache2': 'reload',
+    }
+
     def __init__(self, **kwargs):
         super(HAOpenStackCharm, self).__init__(**kwargs)
         self.set_haproxy_stat_password()
@@ -1366,7 +2046,8 @@ class HAOpenStackCharm(OpenStackAPICharm):
                 ['a2query', '-s', 'openstack_https_frontend'])
             if check_enabled != 0:
                 subprocess.check_call(['a2ensite', 'openstack_https_frontend'])
-                ch_host.service_reload('apache2', restart_on_failure=True)
+                self.schedule_restart(['apache2'], action='reload')
+                flush_restarts()
 
     def configure_apache(self):
         if self.apache_enabled():
@@ -1375,12 +2056,13 @@ class HAOpenStackCharm(OpenStackAPICharm):
             self.enable_apache_ssl_vhost()
 
     @property
+    @cached_per_hook
     def all_packages(self):
         """List of packages to be installed
 
         @return ['pkg1', 'pkg2', ...]
         """
-        _packages = super(HAOpenStackCharm, self).all_packages
+        _packages = list(super(HAOpenStackCharm, self).all_packages)
         if self.haproxy_enabled():
             _packages.append('haproxy')
         if self.apache_enabled():
@@ -1388,6 +2070,7 @@ class HAOpenStackCharm(OpenStackAPICharm):
         return _packages
 
     @property
+    @cached_per_hook
     def full_restart_map(self):
         """Map of services to be restarted if a file changes
 
@@ -1437,9 +2120,9 @@ class HAOpenStackCharm(OpenStackAPICharm):
         @param hacluster instance of interface class HAClusterRequires
         """
         for vip in self.config.get(VIP_KEY, '').split():
-            iface = (ch_ip.get_iface_for_address(vip) or
+            iface = (os_ip.get_iface_for_address(vip) or
                      self.config.get(IFACE_KEY))
-            netmask = (ch_ip.get_netmask_for_address(vip) or
+            netmask = (os_ip.get_netmask_for_address(vip) or
                        self.config.get(CIDR_KEY))
             if iface is not None:
                 hacluster.add_vip(self.name, vip, iface, netmask)
@@ -1468,7 +2151,8 @@ class HAOpenStackCharm(OpenStackAPICharm):
                 subprocess.check_call(['a2enmod', module])
                 restart = True
         if restart:
-            ch_host.service_restart('apache2')
+            self.schedule_restart(['apache2'])
+            flush_restarts()
 
     def configure_cert(self, cert, key, cn=None):
         """Configure service SSL cert and key
@@ -1638,13 +2322,133 @@ class HAOpenStackCharm(OpenStackAPICharm):
     def update_peers(self, cluster):
         for addr_type in os_ip.ADDRESS_MAP.keys():
             cidr = self.config.get(os_ip.ADDRESS_MAP[addr_type]['config'])
-            laddr = ch_ip.get_address_in_network(cidr)
+            laddr = os_ip.get_address_in_network(cidr)
             if laddr:
                 cluster.set_address(
                     os_ip.ADDRESS_MAP[addr_type]['binding'],
                     laddr)
 
 
+def evaluate_state_check_plan(plan, available_states):
+    """Evaluate a plan from OpenStackCharm.state_check_plan() against the
+    states that are set.  The checks for each relation are evaluated in order,
+    stopping at the first failure.
+
+    :param plan: ((relation, ((state, err_status, err_msg), ...)), ...)
+    :param available_states: set of the states that are set
+    :returns: (status, message) or (None, None) if all of the states are set.
+    """
+    status = None
+    messages = []
+    for relation, states in plan:
+        for state, err_status, err_msg in states:
+            if state not in available_states:
+                messages.append(err_msg)
+                status = os_utils.workload_state_compare(status, err_status)
+                # as soon as we error on a relation, skip to the next one.
+                break
+    if status is not None:
+        return status, ", ".join(messages)
+    # Everything is fine.
+    return None, None
+
+
+def parse_port_spec(spec, protocol='tcp'):
+    """Expand a port specification into the ports that it covers.
+
+    :param spec: a port number, or a string of the form
+        '<port>[-<port>][/<protocol>]', e.g. '8000-8010/udp'
+    :param protocol: the protocol if the spec doesn't give one.
+    :returns: set of (port, protocol) with the protocol in lower case.
+    """
+    spec = str(spec)
+    if '/' in spec:
+        spec, protocol = spec.split('/', 1)
+    start, _, end = spec.partition('-')
+    protocol = protocol.lower()
+    return {(port, protocol)
+            for port in range(int(start), int(end or start) + 1)}
+
+
+def compress_ports(ports):
+    """Collapse a set of ports into ranges of contiguous ports.
+
+    :param ports: set of (port, protocol)
+    :returns: sorted list of [range, protocol], where range is either
+        '<port>' or '<from>-<to>'
+    """
+    runs = []
+    for port, protocol in sorted(ports, key=lambda p: (p[1], p[0])):
+        if runs and runs[-1][2] == protocol and runs[-1][1] == port - 1:
+            runs[-1][1] = port
+        else:
+            runs.append([port, port, protocol])
+    return [[str(start) if start == end else '{}-{}'.format(start, end),
+             protocol]
+            for start, end, protocol in runs]
+
+
+def probe_ports(ports, address='0.0.0.0', timeout=1.0):
+    """Return the ports that are accepting connections on address.  The
+    ports are probed concurrently, each waiting at most timeout seconds.
+
+    :param ports: list of port numbers
+    :param address: the address to connect to
+    :param timeout: seconds to wait for each connection
+    :returns: set of the open ports
+    """
+    open_ports = set()
+
+    def _probe(port):
+        try:
+            sock = socket.create_connection((address, port), timeout)
+        except (socket.error, socket.timeout):
+            return
+        sock.close()
+        open_ports.add(port)
+
+    if len(ports) < 2:
+        for port in ports:
+            _probe(port)
+        return open_ports
+    threads = [threading.Thread(target=_probe, args=(port, ))
+               for port in ports]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return open_ports
+
+
+def apt_sources_digest():
+    """Return a digest of the contents of the apt source lists.
+
+    :returns: str hex digest
+    """
+    digest = hashlib.sha256()
+    for path in [APT_SOURCES_LIST] + sorted(glob.glob(APT_SOURCES_PARTS)):
+        digest.update(path.encode('UTF-8'))
+        try:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        except IOError:
+            pass
+    return digest.hexdigest()
+
+
+def dpkg_status_fingerprint():
+    """Return a fingerprint of the installed packages: the mtime and size of
+    the dpkg status file.
+
+    :returns: [mtime, size] or None if the status file can't be read.
+    """
+    try:
+        st = os.stat(DPKG_STATUS)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
 # TODO: drop once charmhelpers releases a new version
 #       with this function in the fetch helper (> 0.9.1)
 def get_upstream_version(package):
@@ -1653,7 +2457,7 @@ def get_upstream_version(package):
     @returns None (if not installed) or the upstream version
     """
     import apt_pkg
-    cache = fetch.apt_cache()
+    cache = get_apt_cache()
     try:
         pkg = cache[package]
     except:
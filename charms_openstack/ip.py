@@ -46,6 +46,23 @@ ADDRESS_MAP = {
     },
 }
 
+# `_address_cache` holds the addresses resolved by resolve_address() during a
+# hook invocation, keyed by the arguments and the config that they depend on.
+_address_cache = {}
+_address_cache_stats = {'hits': 0, 'misses': 0}
+
+# `_vip_matchers` holds a VIPMatcher for each `vip` config value seen during a
+# hook invocation.
+_vip_matchers = {}
+
+# `_interface_table` memoizes the lookups against the local interfaces (each
+# of which enumerates all of the host's interfaces) during a hook invocation.
+_interface_table = {}
+
+# `_binding_table` holds, for each binding, the primary address and the CIDRs
+# from a single network-get call during a hook invocation.
+_binding_table = {}
+
 
 def canonical_url(endpoint_type=PUBLIC):
     """
@@ -98,6 +115,47 @@ def _network_get_primary_address(binding):
     return address
 
 
+def _interface_lookup(kind, f, *args):
+    """Return f(*args), memoized in the interface table for the hook."""
+    key = (kind, ) + args
+    try:
+        return _interface_table[key]
+    except KeyError:
+        value = _interface_table[key] = f(*args)
+        return value
+
+
+def get_address_in_network(network, fallback=None):
+    """Memoized version of net_ip.get_address_in_network()
+
+    :param network: the network CIDR (or space separated CIDRs) to look in
+    :param fallback: [optional] the address to return if there isn't one
+    :returns: the local address on the network, or fallback
+    """
+    return _interface_lookup('address', net_ip.get_address_in_network,
+                             network, fallback)
+
+
+def get_netmask_for_address(address):
+    """Memoized version of net_ip.get_netmask_for_address()
+
+    :param address: a local address
+    :returns: the netmask of the interface with the address, or None
+    """
+    return _interface_lookup('netmask', net_ip.get_netmask_for_address,
+                             address)
+
+
+def get_iface_for_address(address):
+    """Memoized version of net_ip.get_iface_for_address()
+
+    :param address: an address
+    :returns: the name of the local interface on the address's network,
+        or None
+    """
+    return _interface_lookup('iface', net_ip.get_iface_for_address, address)
+
+
 def _resolve_network_cidr(ip_address):
     '''
     Resolves the full address cidr of an ip_address based on
@@ -106,13 +164,196 @@ def _resolve_network_cidr(ip_address):
     This is in charmhelpers trunk but not in pypi. Please revert to using
     charmhelpers version when pypi has been updated
     '''
-    netmask = net_ip.get_netmask_for_address(ip_address)
+    netmask = get_netmask_for_address(ip_address)
     return str(netaddr.IPNetwork("%s/%s" % (ip_address, netmask)).cidr)
 
 
+def _address_cache_key(endpoint_type, override):
+    """Return the key used to cache the address resolved for endpoint_type;
+    it includes the config that the resolution depends on so that a change
+    to the config misses the cache.
+    """
+    return (endpoint_type, override,
+            hookenv.config(ADDRESS_MAP[endpoint_type]['override']),
+            hookenv.config('vip'),
+            hookenv.config(ADDRESS_MAP[endpoint_type]['config']),
+            hookenv.config('prefer-ipv6'))
+
+
+def flush_address_cache():
+    """Discard the addresses cached by resolve_address(), the binding
+    information from network-get and the local interface lookups; this needs
+    to be called if the cluster state or network configuration changes
+    during the hook.
+    """
+    _address_cache.clear()
+    _interface_table.clear()
+    _binding_table.clear()
+    _vip_matchers.clear()
+
+
+def address_cache_stats():
+    """Return the hits and misses of the resolve_address() cache.
+
+    :returns: dictionary of {'hits': int, 'misses': int}
+    """
+    return dict(_address_cache_stats)
+
+
+class VIPMatcher(object):
+    """Match the configured VIPs to the networks that they are on.
+
+    The VIPs are parsed once into integers and the networks into integer
+    ranges (which are cached), so that matching is just comparisons.  If a
+    VIP or network can't be parsed then matching falls back to
+    net_ip.is_address_in_network() so that errors are reported as before.
+    """
+
+    def __init__(self, vips):
+        """
+        :param vips: list of VIP addresses, in order of preference.
+        """
+        self.vips = list(vips)
+        self._ranges = {}
+        try:
+            self._addresses = [
+                (a.version, int(a))
+                for a in (netaddr.IPAddress(vip) for vip in self.vips)]
+        except (netaddr.AddrFormatError, ValueError, TypeError):
+            self._addresses = None
+
+    def _range(self, cidr):
+        """Return (version, first, last) for the cidr or None if it can't be
+        parsed.
+        """
+        try:
+            return self._ranges[cidr]
+        except KeyError:
+            pass
+        try:
+            network = netaddr.IPNetwork(cidr)
+            _range = (network.version, network.first, network.last)
+        except (netaddr.AddrFormatError, ValueError, TypeError):
+            _range = None
+        self._ranges[cidr] = _range
+        return _range
+
+    def match(self, cidrs):
+        """Return the first VIP that is in one of the networks.
+
+        :param cidrs: list of network CIDRs
+        :returns: a VIP or None if none of the VIPs are on the networks.
+        """
+        ranges = [self._range(cidr) for cidr in cidrs]
+        if self._addresses is None or None in ranges:
+            for vip in self.vips:
+                for cidr in cidrs:
+                    if net_ip.is_address_in_network(cidr, vip):
+                        return vip
+            return None
+        for vip, (version, value) in zip(self.vips, self._addresses):
+            for _version, first, last in ranges:
+                if version == _version and first <= value <= last:
+                    return vip
+        return None
+
+
+def get_vip_matcher(vips):
+    """Return the VIPMatcher for the vips, creating it once per hook.
+
+    :param vips: list of VIP addresses
+    :returns: VIPMatcher instance
+    """
+    key = tuple(vips)
+    try:
+        return _vip_matchers[key]
+    except KeyError:
+        matcher = _vip_matchers[key] = VIPMatcher(vips)
+        return matcher
+
+
+def _get_binding_info(binding):
+    """Return the primary address and CIDRs of a binding, using a single
+    network-get call per binding per hook.
+
+    If network-get can't return the full binding information then only the
+    primary address is fetched, and the CIDR is left to be worked out from
+    the local interfaces when it is needed.
+
+    :param binding: the name of the binding
+    :returns: {'address': str, 'cidr': str or None, 'cidrs': [str, ...]}
+    :raises: NotImplementedError if the binding can't be resolved.
+    """
+    try:
+        return _binding_table[binding]
+    except KeyError:
+        pass
+    info = None
+    try:
+        result = hookenv.network_get(binding)
+    except NotImplementedError:
+        result = None
+    if isinstance(result, dict) and 'bind-addresses' in result:
+        cidrs = []
+        address = None
+        cidr = None
+        for bind_address in result['bind-addresses']:
+            for entry in bind_address.get('addresses', []):
+                if address is None:
+                    address = entry['address']
+                    cidr = entry.get('cidr')
+                if entry.get('cidr') and entry['cidr'] not in cidrs:
+                    cidrs.append(entry['cidr'])
+        if address is not None:
+            info = {'address': address, 'cidr': cidr, 'cidrs': cidrs}
+    if info is None:
+        info = {'address': _network_get_primary_address(binding),
+                'cidr': None,
+                'cidrs': []}
+    _binding_table[binding] = info
+    return info
+
+
+def _match_vip_in_binding(binding, vips):
+    """Return the first of the vips that is on one of the binding's networks,
+    or None if none of them are.
+
+    :param binding: the name of the binding
+    :param vips: list of vip addresses
+    :raises: NotImplementedError if the binding can't be resolved.
+    """
+    info = _get_binding_info(binding)
+    if not info['cidr']:
+        info['cidr'] = _resolve_network_cidr(info['address'])
+        info['cidrs'].append(info['cidr'])
+    return get_vip_matcher(vips).match(info['cidrs'])
+
+
 def resolve_address(endpoint_type=PUBLIC, override=True):
     """Return unit address depending on net config.
 
+    The address is cached for the hook invocation; see _resolve_address() for
+    how it is determined.
+
+    :param endpoint_type: Network endpoing type
+    :param override: Accept hostname overrides or not
+    """
+    key = _address_cache_key(endpoint_type, override)
+    try:
+        address = _address_cache[key]
+        _address_cache_stats['hits'] += 1
+        return address
+    except KeyError:
+        pass
+    _address_cache_stats['misses'] += 1
+    address = _resolve_address(endpoint_type, override)
+    _address_cache[key] = address
+    return address
+
+
+def _resolve_address(endpoint_type=PUBLIC, override=True):
+    """Return unit address depending on net config.
+
     If unit is clustered with vip(s) and has net splits defined, return vip on
     correct network. If clustered with no nets defined, return primary vip.
 
@@ -140,21 +381,12 @@ def resolve_address(endpoint_type=PUBLIC, override=True):
 
     if clustered and vips:
         if net_addr:
-            for vip in vips:
-                if net_ip.is_address_in_network(net_addr, vip):
-                    resolved_address = vip
-                    break
+            resolved_address = get_vip_matcher(vips).match([net_addr])
         else:
             # NOTE: endeavour to check vips against network space
             #       bindings
             try:
-                bound_cidr = _resolve_network_cidr(
-                    _network_get_primary_address(binding)
-                )
-                for vip in vips:
-                    if net_ip.is_address_in_network(bound_cidr, vip):
-                        resolved_address = vip
-                        break
+                resolved_address = _match_vip_in_binding(binding, vips)
             except NotImplementedError:
                 # If no net-splits configured and no support for extra
                 # bindings/network spaces so we expect a single vip
@@ -166,13 +398,13 @@ def resolve_address(endpoint_type=PUBLIC, override=True):
             fallback_addr = hookenv.unit_get(net_fallback)
 
         if net_addr:
-            resolved_address = net_ip.get_address_in_network(net_addr,
-                                                             fallback_addr)
+            resolved_address = get_address_in_network(net_addr,
+                                                      fallback_addr)
         else:
             # NOTE: only try to use extra bindings if legacy network
             #       configuration is not in use
             try:
-                resolved_address = _network_get_primary_address(binding)
+                resolved_address = _get_binding_info(binding)['address']
             except NotImplementedError:
                 resolved_address = fallback_addr
 
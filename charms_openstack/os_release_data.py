@@ -16,18 +16,204 @@
 # reactive framework.
 
 # need/want absolute imports for the package imports to work properly
+from __future__ import absolute_import
 
-KNOWN_RELEASES = [
-    'diablo',
-    'essex',
-    'folsom',
-    'grizzly',
-    'havana',
-    'icehouse',
-    'juno',
-    'kilo',
-    'liberty',
-    'mitaka',
-    'newton',
-    'ocata',
+import json
+
+import six
+
+import charmhelpers.contrib.openstack.utils as os_utils
+import charmhelpers.core.host as ch_host
+
+# The built-in release data: (release, ubuntu series, version), in release
+# order.  More releases can be added with register_release() or
+# load_release_data() without changing this table.
+_DEFAULT_RELEASES = [
+    ('diablo', 'oneiric', '2011.2'),
+    ('essex', 'precise', '2012.1'),
+    ('folsom', 'quantal', '2012.2'),
+    ('grizzly', 'raring', '2013.1'),
+    ('havana', 'saucy', '2013.2'),
+    ('icehouse', 'trusty', '2014.1'),
+    ('juno', 'utopic', '2014.2'),
+    ('kilo', 'vivid', '2015.1'),
+    ('liberty', 'wily', '2015.2'),
+    ('mitaka', 'xenial', '2016.1'),
+    ('newton', 'yakkety', '2016.2'),
+    ('ocata', 'zesty', '2017.1'),
 ]
+
+KNOWN_RELEASES = [release for release, _, _ in _DEFAULT_RELEASES]
+
+# The position of each release in KNOWN_RELEASES, so that releases can be
+# compared as integers.
+RELEASE_ORDINALS = {release: i for i, release in enumerate(KNOWN_RELEASES)}
+
+# Ubuntu series -> the OpenStack release that it ships.
+UBUNTU_SERIES = {series: release for release, series, _ in _DEFAULT_RELEASES}
+
+# OpenStack release -> version number, e.g. 'ocata' -> '2017.1'
+RELEASE_VERSIONS = {release: version
+                    for release, _, version in _DEFAULT_RELEASES}
+
+# package -> {major version: release} for the releases registered here.  This
+# extends (and overrides) charmhelpers' PACKAGE_CODENAMES; see
+# get_package_codenames()
+PACKAGE_CODENAMES = {}
+
+# `_package_codenames` holds the merged table returned by
+# get_package_codenames(), and the charmhelpers table it was built from.
+_package_codenames = {
+    'source': None,
+    'table': None,
+}
+
+
+def register_release(release, series=None, version=None, packages=None):
+    """Add a release to the registry, or extend the data for a release that
+    is already known.  New releases are added after the existing ones.
+
+    :param release: lc string representing an OpenStack release
+    :param series: the Ubuntu series that ships the release, if any
+    :param version: the version number of the release, e.g. '2017.1'
+    :param packages: dictionary of package -> major version for the release
+    """
+    if release not in RELEASE_ORDINALS:
+        KNOWN_RELEASES.append(release)
+        RELEASE_ORDINALS[release] = len(KNOWN_RELEASES) - 1
+    if series:
+        UBUNTU_SERIES[series] = release
+    if version:
+        RELEASE_VERSIONS[release] = version
+    for package, major_version in six.iteritems(packages or {}):
+        PACKAGE_CODENAMES.setdefault(package, {})[str(major_version)] = release
+    _package_codenames['source'] = None
+
+
+def load_release_data(path):
+    """Register the releases described in a JSON data file, e.g.
+
+        {"releases": [{"name": "pike",
+                       "series": "artful",
+                       "version": "2017.2",
+                       "packages": {"nova-common": "16"}}]}
+
+    The releases are registered in the order that they appear in the file.
+
+    :param path: the path of the data file
+    """
+    with open(path) as f:
+        data = json.load(f)
+    for entry in data.get('releases', []):
+        register_release(entry['name'],
+                         series=entry.get('series'),
+                         version=entry.get('version'),
+                         packages=entry.get('packages'))
+
+
+# `_install_source_codenames` holds the release codename for each
+# openstack-origin string that has been resolved during this hook.
+_install_source_codenames = {}
+
+
+def release_ordinal(release):
+    """Return the position of the release in KNOWN_RELEASES.
+
+    :param release: lc string representing an OpenStack release
+    :returns: int or None if the release isn't known.
+    """
+    return RELEASE_ORDINALS.get(release)
+
+
+def release_for_series(series):
+    """Return the OpenStack release shipped with an Ubuntu series.
+
+    :param series: the Ubuntu series, e.g. 'xenial'
+    :returns: lc string representing the release, or None
+    """
+    return UBUNTU_SERIES.get(series)
+
+
+def release_version(release):
+    """Return the version number of a release, e.g. 'ocata' -> '2017.1'.
+    Releases that aren't registered here are looked up in charmhelpers'
+    OPENSTACK_CODENAMES.
+
+    :param release: lc string representing an OpenStack release
+    :returns: str version number, or None if the release isn't known.
+    """
+    try:
+        return RELEASE_VERSIONS[release]
+    except KeyError:
+        for version, codename in six.iteritems(os_utils.OPENSTACK_CODENAMES):
+            if codename == release:
+                return version
+    return None
+
+
+def get_package_codenames():
+    """Return the package -> {major version: release} table to use when
+    working out the release from an installed package: charmhelpers'
+    PACKAGE_CODENAMES, extended by the packages registered here.
+
+    :returns: dictionary of package -> {major version: release}
+    """
+    source = os_utils.PACKAGE_CODENAMES
+    if (_package_codenames['source'] is not source or
+            _package_codenames['table'] is None):
+        table = {package: dict(versions)
+                 for package, versions in six.iteritems(source)}
+        for package, versions in six.iteritems(PACKAGE_CODENAMES):
+            table.setdefault(package, {}).update(versions)
+        _package_codenames['source'] = source
+        _package_codenames['table'] = table
+    return _package_codenames['table']
+
+
+def _registry_codename_install_source(origin):
+    """Return the release for an installation source using the releases
+    registered here, or None if the registry can't tell.
+
+    'distro' sources are resolved from the Ubuntu series of the unit and
+    'cloud:<series>-<release>' sources from the release in the pocket.
+
+    :param origin: the installation source, e.g. 'cloud:xenial-ocata'
+    :returns: lc string representing the release, or None
+    """
+    if not origin:
+        return None
+    if origin in ('distro', 'distro-proposed', 'proposed'):
+        return release_for_series(ch_host.lsb_release()['DISTRIB_CODENAME'])
+    if origin.startswith('cloud:'):
+        pocket = origin.split(':', 1)[1]
+        release = pocket.partition('-')[2].split('/')[0]
+        if release in RELEASE_ORDINALS:
+            return release
+    return None
+
+
+def get_os_codename_install_source(origin):
+    """Return the release codename for an installation source (e.g. the
+    openstack-origin config option).  The result is cached for the hook.
+
+    The registered releases are used first, so that releases added with
+    register_release() or load_release_data() are recognised; anything else
+    is resolved by charmhelpers.
+
+    :param origin: the installation source, e.g. 'cloud:xenial-ocata'
+    :returns: lc string representing the release, or None
+    """
+    try:
+        return _install_source_codenames[origin]
+    except KeyError:
+        codename = (_registry_codename_install_source(origin) or
+                    os_utils.get_os_codename_install_source(origin))
+        _install_source_codenames[origin] = codename
+        return codename
+
+
+def flush_release_cache():
+    """Forget the codenames cached by get_os_codename_install_source(), e.g.
+    after the installation source has been changed.
+    """
+    _install_source_codenames.clear()
@@ -76,10 +76,88 @@ class TestOpenStackRelationAdapter(unittest.TestCase):
         with self.assertRaises(AttributeError):
             ad.relation_name = 'hello'
 
+    def test_class_accessor_properties(self):
+        accessors = ['some']
+        ad = adapters.OpenStackRelationAdapter(MyRelation(), accessors)
+        ad2 = adapters.OpenStackRelationAdapter(MyRelation(), accessors)
+        # the accessor class is created once, and the list isn't modified
+        self.assertIs(type(ad), type(ad2))
+        self.assertIsInstance(ad, adapters.OpenStackRelationAdapter)
+        self.assertEqual(accessors, ['some'])
+        # another set of accessors doesn't leak into the adapter class
+        ad3 = adapters.OpenStackRelationAdapter(MyRelation())
+        self.assertIsNot(type(ad), type(ad3))
+        self.assertFalse(hasattr(ad3, 'some'))
+        self.assertFalse(hasattr(adapters.OpenStackRelationAdapter, 'this'))
+        self.assertEqual(ad3.this, 'this')
+
     def test_class_no_relation(self):
         ad = adapters.OpenStackRelationAdapter(relation_name='cluster')
         self.assertEqual(ad.relation_name, 'cluster')
 
+    def test_prefetch(self):
+
+        class FakeConversation(object):
+            relation_ids = ['rel:1']
+            units = {'unit/0', 'unit/1'}
+
+        class FakeConvRelation(MyRelation):
+            auto_accessors = ['this', 'that-one']
+
+            def conversation(self):
+                return FakeConversation()
+
+            def that_one(self):
+                raise AssertionError("should be prefetched")
+
+        settings = {
+            'unit/0': {'this': 'this0'},
+            'unit/1': {'this': 'this1', 'that-one': 'that1'},
+            'unit/2': {'this': 'this2', 'that-one': 'that2'},
+        }
+        adapters.flush_relation_settings()
+        with mock.patch.object(adapters.hookenv, 'related_units',
+                               return_value=['unit/0', 'unit/1', 'unit/2']), \
+                mock.patch.object(adapters.hookenv, 'hook_name',
+                                  return_value='config-changed'), \
+                mock.patch.object(adapters.hookenv, 'relation_get') as rget:
+            rget.side_effect = lambda unit=None, rid=None: settings[unit]
+            ad = adapters.OpenStackRelationAdapter(FakeConvRelation(),
+                                                   ['some'])
+            self.assertEqual(ad.this, 'this0')
+            self.assertEqual(ad.that_one, 'that1')
+            self.assertEqual(ad.some, 'thing')
+            # a second adapter in the same hook uses the same settings.
+            ad2 = adapters.OpenStackRelationAdapter(FakeConvRelation())
+            self.assertEqual(ad2.that_one, 'that1')
+            rget.assert_has_calls([mock.call(unit='unit/0', rid='rel:1'),
+                                   mock.call(unit='unit/1', rid='rel:1')],
+                                  any_order=True)
+            self.assertEqual(rget.call_count, 2)
+        adapters.flush_relation_settings()
+
+    def test_prefetch_fallback(self):
+
+        class NoScopeRelation(MyRelation):
+
+            def conversation(self):
+                raise ValueError("no current hook or global scope")
+
+        class BrokenRelation(MyRelation):
+
+            def conversation(self):
+                raise KeyError('oops')
+
+        # relations without a conversation use the accessors directly
+        self.assertIsNone(
+            adapters.OpenStackRelationAdapter(MyRelation()).prefetch())
+        ad = adapters.OpenStackRelationAdapter(NoScopeRelation())
+        self.assertIsNone(ad.prefetch())
+        self.assertEqual(ad.this, 'this')
+        # but other errors aren't hidden
+        with self.assertRaises(KeyError):
+            adapters.OpenStackRelationAdapter(BrokenRelation()).prefetch()
+
     def test_make_default_relation_adapter(self):
         # test that no properties just gets the standard one.
         self.assertEqual(
@@ -101,6 +179,18 @@ class TestOpenStackRelationAdapter(unittest.TestCase):
         self.assertIsInstance(i, FakeRelation)
         self.assertEqual(i.b, 4)
 
+        # the class is only made once for the same base, relation and props
+        self.assertIs(adapters.make_default_relation_adapter(
+            FakeRelation, 'my./?-int', {'b': b}), kls)
+
+        def c(int):
+            return int.a
+
+        self.assertIsNot(adapters.make_default_relation_adapter(
+            FakeRelation, 'my./?-int', {'b': c}), kls)
+        self.assertIsNot(adapters.make_default_relation_adapter(
+            FakeRelation, 'other', {'b': b}), kls)
+
 
 class FakeRabbitMQRelation():
 
@@ -178,6 +268,10 @@ class FakePeerRelation():
 
 class TestPeerHARelationAdapter(unittest.TestCase):
 
+    def setUp(self):
+        adapters.flush_relation_settings()
+        self.addCleanup(adapters.flush_relation_settings)
+
     def test_class(self):
         test_config = {
             'os-public-network': 'public_network',
@@ -231,9 +325,9 @@ class TestPeerHARelationAdapter(unittest.TestCase):
         }
         del expect_local_ns['this_unit_private_addr']
         # Tests PeerHARelationAdapter with peers
-        with mock.patch.object(adapters.ch_ip, 'get_address_in_network',
+        with mock.patch.object(adapters.os_ip, 'get_address_in_network',
                                new=lambda x: test_addresses.get(x)), \
-                mock.patch.object(adapters.ch_ip, 'get_netmask_for_address',
+                mock.patch.object(adapters.os_ip, 'get_netmask_for_address',
                                   new=lambda x: test_netmasks.get(x)), \
                 mock.patch.object(adapters, 'APIConfigurationAdapter',
                                   side_effect=FakeAPIConfigAdapter), \
@@ -255,9 +349,9 @@ class TestPeerHARelationAdapter(unittest.TestCase):
                 'this_unit_internal_addr'])
 
         # Tests PeerHARelationAdapter without peers
-        with mock.patch.object(adapters.ch_ip, 'get_address_in_network',
+        with mock.patch.object(adapters.os_ip, 'get_address_in_network',
                                new=lambda x: test_addresses.get(x)), \
-                mock.patch.object(adapters.ch_ip, 'get_netmask_for_address',
+                mock.patch.object(adapters.os_ip, 'get_netmask_for_address',
                                   new=lambda x: test_netmasks.get(x)), \
                 mock.patch.object(adapters, 'APIConfigurationAdapter',
                                   side_effect=FakeAPIConfigAdapter), \
@@ -285,6 +379,113 @@ class TestPeerHARelationAdapter(unittest.TestCase):
                 peer_ra = adapters.PeerHARelationAdapter(FakePeerRelation())
                 self.assertEqual(peer_ra.single_mode_map, {})
 
+    def test_single_mode_map_cached(self):
+        test_config = {}
+        with mock.patch.object(adapters.os_ip, 'get_address_in_network',
+                               return_value=None), \
+                mock.patch.object(adapters.os_ip, 'get_netmask_for_address',
+                                  return_value='mask') as netmask, \
+                mock.patch.object(adapters, 'APIConfigurationAdapter',
+                                  side_effect=FakeAPIConfigAdapter), \
+                mock.patch.object(adapters.hookenv, 'config',
+                                  new=lambda: test_config), \
+                mock.patch.object(adapters.hookenv, 'relation_ids',
+                                  new=lambda x: ['rid1']), \
+                mock.patch.object(adapters.hookenv, 'related_units',
+                                  new=lambda relid: []):
+            smm = adapters.PeerHARelationAdapter(
+                relation_name='cluster').single_mode_map
+            self.assertEqual(netmask.call_count, 1)
+            smm['cluster_hosts'].clear()
+            smm2 = adapters.PeerHARelationAdapter(
+                relation_name='cluster').single_mode_map
+            self.assertEqual(netmask.call_count, 1)
+            self.assertEqual(
+                smm2['cluster_hosts'],
+                {'this_unit_private_addr': {
+                    'backends': {'this_unit-1': 'this_unit_private_addr'},
+                    'network': 'this_unit_private_addr/mask'}})
+
+    def test_peer_addresses_fallback_errors(self):
+
+        class BrokenConvPeerRelation(FakePeerRelation):
+
+            def conversations(self):
+                raise KeyError('oops')
+
+        with mock.patch.object(adapters, 'APIConfigurationAdapter',
+                               side_effect=FakeAPIConfigAdapter), \
+                mock.patch.object(adapters.hookenv, 'config',
+                                  new=lambda: {}):
+            peer_ra = adapters.PeerHARelationAdapter(
+                relation_name='cluster')
+            peer_ra.relation = BrokenConvPeerRelation()
+            with self.assertRaises(KeyError):
+                peer_ra.peer_addresses()
+            peer_ra.relation = FakePeerRelation()
+            self.assertEqual(peer_ra.peer_addresses('admin-address'),
+                             [('peer_unit-1', 'peer_unit1_admin_addr'),
+                              ('peer_unit-2', 'peer_unit2_admin_addr')])
+
+    def test_peer_addresses_conversations(self):
+
+        class FakeConversation(object):
+            relation_ids = ['cluster:1']
+
+            def __init__(self, unit):
+                self.scope = unit
+                self.units = {unit}
+
+        class FakeConvPeerRelation(FakePeerRelation):
+
+            def conversations(self):
+                return [FakeConversation('peer/1'),
+                        FakeConversation('peer/2')]
+
+            def ip_map(self, address_key=None):
+                raise AssertionError("should use the conversations")
+
+        settings = {
+            'peer/1': {'private-address': 'peer1_private',
+                       'admin-address': 'peer1_admin'},
+            'peer/2': {'private-address': 'peer2_private',
+                       'admin-address': None},
+        }
+        test_config = {'os-admin-network': 'admin_network'}
+        with mock.patch.object(adapters.os_ip, 'get_address_in_network',
+                               new=lambda x: {'admin_network':
+                                              'this_admin'}.get(x)), \
+                mock.patch.object(adapters.os_ip, 'get_netmask_for_address',
+                                  new=lambda x: 'mask'), \
+                mock.patch.object(adapters, 'APIConfigurationAdapter',
+                                  side_effect=FakeAPIConfigAdapter), \
+                mock.patch.object(adapters.hookenv, 'config',
+                                  new=lambda: test_config), \
+                mock.patch.object(adapters.hookenv, 'hook_name',
+                                  return_value='config-changed'), \
+                mock.patch.object(adapters.hookenv, 'related_units',
+                                  return_value=['peer/1', 'peer/2']), \
+                mock.patch.object(adapters.hookenv, 'relation_get') as rget:
+            rget.side_effect = lambda unit=None, rid=None: settings[unit]
+            peer_ra = adapters.PeerHARelationAdapter(FakeConvPeerRelation())
+            expect = {
+                'this_admin': {
+                    'backends': {'peer-1': 'peer1_admin',
+                                 'this_unit-1': 'this_admin'},
+                    'network': 'this_admin/mask'},
+                'this_unit_private_addr': {
+                    'backends': {'peer-1': 'peer1_private',
+                                 'peer-2': 'peer2_private',
+                                 'this_unit-1': 'this_unit_private_addr'},
+                    'network': 'this_unit_private_addr/mask'}}
+            self.assertEqual(peer_ra.cluster_hosts, expect)
+            self.assertEqual(rget.call_count, 2)
+            # a second adapter in the same hook reuses the cluster hosts
+            peer_ra.cluster_hosts['this_admin']['backends'].clear()
+            peer_ra2 = adapters.PeerHARelationAdapter(FakeConvPeerRelation())
+            self.assertEqual(peer_ra2.cluster_hosts, expect)
+            self.assertEqual(rget.call_count, 2)
+
 
 class FakeDatabaseRelation():
 
@@ -348,6 +549,51 @@ class TestConfigurationAdapter(unittest.TestCase):
             self.assertEqual(c.three, 3)
             self.assertEqual(c.that_one, 4)
 
+    def test_class_lazy(self):
+
+        class MyConfig(adapters.ConfigurationAdapter):
+
+            def two(self):
+                return 'method'
+
+        test_config = mock.MagicMock()
+        _config = {'one': 1, 'two': 2, 'that-one': 4}
+        test_config.__getitem__.side_effect = _config.__getitem__
+        test_config.__iter__.side_effect = lambda: iter(_config)
+        test_config.__len__.side_effect = lambda: len(_config)
+        with mock.patch.object(adapters.hookenv, 'config',
+                               new=lambda: test_config):
+            c = MyConfig()
+            # config that replaces a class attribute is set straight away
+            self.assertEqual(c.__dict__['two'], 2)
+            self.assertEqual(test_config.__getitem__.call_count, 1)
+            self.assertEqual(c.that_one, 4)
+            self.assertEqual(c.that_one, 4)
+            self.assertEqual(test_config.__getitem__.call_count, 2)
+            with self.assertRaises(AttributeError):
+                c.not_there
+            # the attribute map is shared between adapters
+            c2 = MyConfig()
+            self.assertIs(c2._config_map, c._config_map)
+            self.assertEqual(c2.one, 1)
+
+    def test_property_attribute_error(self):
+
+        class MyConfig(adapters.ConfigurationAdapter):
+
+            @property
+            def broken(self):
+                return self.not_a_config_item.upper()
+
+        with mock.patch.object(adapters.hookenv, 'config',
+                               new=lambda: {'one': 1}):
+            c = MyConfig()
+            # the error names the attribute that is really missing
+            with self.assertRaises(AttributeError) as e:
+                c.broken
+            self.assertIn('not_a_config_item', str(e.exception))
+            self.assertNotIn("'broken'", str(e.exception))
+
     def test_make_default_configuration_adapter_class(self):
         # test that emply class just gives us a normal ConfigurationAdapter
         self.assertEqual(
@@ -366,6 +612,10 @@ class TestConfigurationAdapter(unittest.TestCase):
         kls = adapters.make_default_configuration_adapter_class(
             None, {'custom_property': custom_property})
         self.assertEqual(kls.__name__, 'DefaultConfigurationAdapter')
+        self.assertIs(
+            adapters.make_default_configuration_adapter_class(
+                None, {'custom_property': custom_property}),
+            kls)
         self.assertTrue(
             'ConfigurationAdapter' in [c.__name__ for c in kls.mro()])
         # instantiate the kls and check for the property
@@ -538,7 +788,7 @@ class TestAPIConfigurationAdapter(unittest.TestCase):
                                   return_value='thisunit'), \
                 mock.patch.object(adapters.os_ip, 'resolve_address',
                                   new=_resolve_address), \
-                mock.patch.object(adapters.ch_ip, 'get_address_in_network',
+                mock.patch.object(adapters.os_ip, 'get_address_in_network',
                                   new=lambda x, y: test_networks[x]):
             c = adapters.APIConfigurationAdapter()
             self.assertEqual(
@@ -674,6 +924,35 @@ class TestAPIConfigurationAdapter(unittest.TestCase):
             self.assertEqual(c.endpoints, expect)
             self.assertEqual(c.ext_ports, [8991, 8992, 8993])
 
+    def test_port_table(self):
+        with mock.patch.object(adapters.APIConfigurationAdapter,
+                               'get_network_addresses',
+                               return_value=[('addr', 'vip')]), \
+                mock.patch.object(adapters.ch_cluster,
+                                  'determine_apache_port') as apache_port, \
+                mock.patch.object(adapters.ch_cluster,
+                                  'determine_api_port') as api_port:
+            apache_port.side_effect = lambda x, singlenode_mode: x - 10
+            api_port.side_effect = lambda x, singlenode_mode: x - 20
+            c = adapters.APIConfigurationAdapter(port_map=self.api_ports)
+            self.assertEqual(c.port_table, [
+                ('svc1', 'admin', 9001),
+                ('svc1', 'internal', 9001),
+                ('svc1', 'public', 9001),
+                ('svc2', 'admin', 9002),
+                ('svc2', 'internal', 9002),
+                ('svc2', 'public', 9003)])
+            self.assertEqual(c.external_ports, {9001, 9002, 9003})
+            c.service_ports
+            c.endpoints
+            self.assertEqual(c.ext_ports, [8991, 8992, 8993])
+            # each port is only worked out once for all of the views
+            self.assertEqual(apache_port.call_count, 3)
+            self.assertEqual(api_port.call_count, 3)
+            # a new port_map rebuilds the table
+            c.port_map = {'svc3': {'admin': 9004}}
+            self.assertEqual(c.port_table, [('svc3', 'admin', 9004)])
+
     def test_apache_enabled(self):
         with mock.patch.object(adapters.charms.reactive.bus,
                                'get_state',
@@ -699,6 +978,8 @@ class TestAPIConfigurationAdapter(unittest.TestCase):
             self.assertEqual(c.determine_service_port(80), 70)
 
     def test_use_memcache(self):
+        adapters.os_release_data.flush_release_cache()
+        self.addCleanup(adapters.os_release_data.flush_release_cache)
         test_config = {'openstack-origin': 'distro'}
         with mock.patch.object(adapters.hookenv, 'config',
                                new=lambda: test_config):
@@ -707,6 +988,7 @@ class TestAPIConfigurationAdapter(unittest.TestCase):
                                    return_value='liberty'):
                 c = adapters.APIConfigurationAdapter()
                 self.assertFalse(c.use_memcache)
+            adapters.os_release_data.flush_release_cache()
             with mock.patch.object(adapters.ch_utils,
                                    'get_os_codename_install_source',
                                    return_value='newton'):
@@ -896,6 +1178,57 @@ class TestOpenStackRelationAdapters(unittest.TestCase):
             self.assertIsInstance(ctxt['some_interface'], FakeThingAdapter)
             self.assertEqual(len(ctxt.keys()), 3)
 
+    def test_freeze(self):
+        calls = []
+
+        class FakeRelation(object):
+            relation_name = 'my-rel'
+            auto_accessors = ['the-host']
+
+            def the_host(self):
+                calls.append('the_host')
+                return 'host1'
+
+        class FakeAdapter(adapters.OpenStackRelationAdapter):
+
+            @property
+            def hosts(self):
+                calls.append('hosts')
+                return ['host1', 'host2']
+
+            @property
+            def broken(self):
+                calls.append('broken')
+                raise AttributeError('broken')
+
+            def host_for(self, n):
+                return 'host{}'.format(n)
+
+        class FakeAdapters(adapters.OpenStackRelationAdapters):
+            relation_adapters = {'my-rel': FakeAdapter}
+
+        with mock.patch.object(adapters.hookenv, 'config',
+                               new=lambda: {'my-opt': 'value'}):
+            a = FakeAdapters([FakeRelation()])
+            frozen = a.freeze()
+            ctxt = dict(frozen)
+        self.assertEqual(sorted(ctxt.keys()), ['my_rel', 'options'])
+        # values are only resolved once, no matter how often they are used.
+        for _ in range(3):
+            self.assertEqual(ctxt['my_rel'].the_host, 'host1')
+            self.assertEqual(frozen.my_rel.hosts, ['host1', 'host2'])
+            with self.assertRaises(AttributeError):
+                frozen.my_rel.broken
+        self.assertEqual(calls, ['the_host', 'hosts', 'broken'])
+        self.assertEqual(frozen.options.my_opt, 'value')
+        # methods are still available
+        self.assertEqual(frozen.my_rel.host_for(3), 'host3')
+        # and the snapshot is read-only
+        with self.assertRaises(TypeError):
+            frozen.my_rel.hosts.append('host3')
+        with self.assertRaises(AttributeError):
+            frozen.my_rel.the_host = 'host2'
+
 
 class MyRelationAdapter(adapters.OpenStackRelationAdapter):
 
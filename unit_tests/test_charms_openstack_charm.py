@@ -22,6 +22,9 @@ from __future__ import absolute_import
 
 import base64
 import collections
+import os
+import shutil
+import tempfile
 import unittest
 
 import mock
@@ -57,12 +60,28 @@ class BaseOpenStackCharmTest(utils.BaseTestCase):
         self.target = None
         # if we've created a singleton on the module, also destroy that.
         chm._singleton = None
+        chm._restart_scheduler = None
+        chm._apt_cache = None
+        chm._install_planner = None
+        chm.os_ip.flush_address_cache()
+        chm.os_release_data.flush_release_cache()
         super(BaseOpenStackCharmTest, self).tearDown()
 
     def patch_target(self, attr, return_value=None, name=None, new=None):
         # uses BaseTestCase.patch_object() to patch targer.
         self.patch_object(self.target, attr, return_value, name, new)
 
+    def _patch_kv(self):
+        # back unitdata.kv() with a dict, which is returned.
+        store = {}
+        self.patch_object(chm.unitdata, 'kv', return_value=mock.MagicMock())
+        self.kv.return_value.get.side_effect = \
+            lambda key, default=None: store.get(key, default)
+        self.kv.return_value.set.side_effect = store.__setitem__
+        self.kv.return_value.unset.side_effect = \
+            lambda key: store.pop(key, None)
+        return store
+
 
 class TestOpenStackCharmMeta(BaseOpenStackCharmTest):
 
@@ -137,6 +156,142 @@ class TestFunctions(BaseOpenStackCharmTest):
         # release is passed?
         self.assertIsInstance(chm.get_charm_instance(), self.C3)
 
+    def test_release_dispatch_table(self):
+        dispatch = chm._get_release_dispatch()
+        self.assertEqual(dispatch['table']['juno'], self.C1)
+        self.assertEqual(dispatch['table']['liberty'], self.C2)
+        self.assertEqual(dispatch['table']['ocata'], self.C3)
+        self.assertNotIn('havana', dispatch['table'])
+        self.assertIs(chm._get_release_dispatch(), dispatch)
+
+    def test_probe_ports(self):
+        self.patch_object(chm.socket, 'create_connection')
+        sock = mock.MagicMock()
+
+        def _connect(address, timeout):
+            self.assertEqual(timeout, 0.5)
+            if address[1] == 2:
+                raise chm.socket.error()
+            return sock
+
+        self.create_connection.side_effect = _connect
+        self.assertEqual(chm.probe_ports([1, 2, 3], timeout=0.5), {1, 3})
+        self.assertEqual(sock.close.call_count, 2)
+        self.assertEqual(chm.probe_ports([2], timeout=0.5), set())
+        self.assertEqual(chm.probe_ports([], timeout=0.5), set())
+
+    def test_install_planner_configure_source(self):
+        self.patch_object(chm.os_utils, 'configure_installation_source',
+                          name='cis')
+        self.patch_object(chm.charmhelpers.fetch, 'apt_update')
+        planner = chm.get_install_planner()
+        self.assertIs(chm.get_install_planner(), planner)
+        planner.configure_source('cloud:xenial-ocata')
+        planner.configure_source('cloud:xenial-ocata')
+        self.cis.assert_called_once_with('cloud:xenial-ocata')
+        self.apt_update.assert_called_once_with(fatal=True)
+        planner.configure_source('cloud:xenial-pike', fatal=False)
+        self.apt_update.assert_called_with(fatal=False)
+        self.assertEqual(self.apt_update.call_count, 2)
+
+    def test_install_planner_skips_fresh_update(self):
+        store = self._patch_kv()
+        self.patch_object(chm.os_utils, 'configure_installation_source',
+                          name='cis')
+        self.patch_object(chm.charmhelpers.fetch, 'apt_update')
+        self.patch_object(chm, 'apt_sources_digest', return_value='abc')
+        self.patch_object(chm.time, 'time', return_value=1000.0)
+        chm.InstallPlanner().configure_source('distro', max_age=60)
+        self.assertEqual(store[chm.APT_SOURCE_KEY],
+                         {'source': 'distro', 'digest': 'abc',
+                          'timestamp': 1000.0})
+        # a later hook within max_age doesn't update
+        self.time.return_value = 1030.0
+        planner = chm.InstallPlanner()
+        planner.configure_source('distro', max_age=60)
+        self.apt_update.assert_called_once_with(fatal=True)
+        # ... unless asked to always update, even later in the same hook
+        planner.configure_source('distro')
+        self.assertEqual(self.apt_update.call_count, 2)
+        # ... or the source lists change
+        self.apt_sources_digest.return_value = 'def'
+        chm.InstallPlanner().configure_source('distro', max_age=60)
+        self.assertEqual(self.apt_update.call_count, 3)
+        # ... or the source changes
+        chm.InstallPlanner().configure_source('cloud:xenial-ocata',
+                                              max_age=60)
+        self.assertEqual(self.apt_update.call_count, 4)
+        # ... or the lists are stale
+        self.time.return_value = 2000.0
+        chm.InstallPlanner().configure_source('cloud:xenial-ocata',
+                                              max_age=60)
+        self.assertEqual(self.apt_update.call_count, 5)
+        self.assertEqual(self.cis.call_count, 5)
+
+    def test_apt_sources_digest(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        sources = os.path.join(tmpdir, 'sources.list')
+        self.patch_object(chm, 'APT_SOURCES_LIST', new=sources)
+        self.patch_object(chm, 'APT_SOURCES_PARTS',
+                          new=os.path.join(tmpdir, '*.list.d'))
+        empty = chm.apt_sources_digest()
+        with open(sources, 'w') as f:
+            f.write('deb http://archive.ubuntu.com/ubuntu xenial main\n')
+        digest = chm.apt_sources_digest()
+        self.assertNotEqual(digest, empty)
+        self.assertEqual(chm.apt_sources_digest(), digest)
+        with open(os.path.join(tmpdir, 'cloud.list.d'), 'w') as f:
+            f.write('deb http://ubuntu-cloud.archive.canonical.com/ubuntu '
+                    'xenial-updates/ocata main\n')
+        self.assertNotEqual(chm.apt_sources_digest(), digest)
+
+    def test_install_planner_packages(self):
+        self.patch_object(chm.charmhelpers.fetch,
+                          'filter_installed_packages',
+                          name='fip')
+        self.fip.side_effect = lambda pkgs: [p for p in pkgs if p != 'p1']
+        self.patch_object(chm.charmhelpers.fetch, 'apt_install')
+        planner = chm.InstallPlanner()
+        self.assertEqual(planner.missing_packages(['p1', 'p2']), ['p2'])
+        planner.install(['p2'])
+        self.apt_install.assert_called_once_with(packages=['p2'], fatal=True)
+        # p1 and p2 are known to be installed, so only p3 is looked up.
+        self.assertEqual(planner.missing_packages(['p1', 'p2', 'p3']),
+                         ['p3'])
+        self.fip.assert_called_with(['p3'])
+        self.assertEqual(planner.missing_packages(['p1', 'p2']), [])
+        self.assertEqual(self.fip.call_count, 2)
+
+    def test_get_apt_cache(self):
+        self.patch_object(chm.charmhelpers.fetch, 'apt_cache')
+        self.patch_object(chm.apt, 'init')
+        self.patch_object(chm, '_apt_initialised', new=False)
+        self.apt_cache.side_effect = lambda: {'pkg': mock.MagicMock()}
+        cache = chm.get_apt_cache()
+        self.assertIs(chm.get_apt_cache(), cache)
+        self.apt_cache.assert_called_once_with()
+        chm.init_apt()
+        self.init.assert_called_once_with()
+        chm.invalidate_apt_cache()
+        self.assertIsNot(chm.get_apt_cache(), cache)
+        self.assertEqual(self.apt_cache.call_count, 2)
+
+    def test_release_dispatch_uses_release_order(self):
+        # pretend that the release names wrap around, so alphabetical order
+        # isn't release order.
+        self.patch_object(chm.os_release_data, 'KNOWN_RELEASES',
+                          new=['mitaka', 'icehouse', 'kilo'])
+        self.patch_object(chm.os_release_data, 'RELEASE_ORDINALS',
+                          new={'mitaka': 0, 'icehouse': 1, 'kilo': 2})
+        # force the dispatch table to be rebuilt
+        self.patch_object(chm, '_release_dispatch',
+                          new=dict(chm._release_dispatch, releases=None))
+        self.assertIsInstance(chm.get_charm_instance(), self.C2)
+        self.assertIsInstance(chm.get_charm_instance(release='icehouse'),
+                              self.C1)
+        self.assertEqual(chm._get_release_dispatch()['first'], 'mitaka')
+
 
 class TestRegisterOSReleaseSelector(unittest.TestCase):
 
@@ -258,7 +413,8 @@ class TestDefaults(BaseOpenStackCharmTest):
         self.patch_object(chm.unitdata, 'kv', new=lambda: kv)
         self.patch_object(chm.reactive, 'set_state')
         h.map['charm.installed']()
-        kv.unset.assert_called_once_with(chm.OPENSTACK_RELEASE_KEY)
+        kv.unset.assert_has_calls([mock.call(chm.OPENSTACK_RELEASE_KEY),
+                                   mock.call(chm.RELEASE_CLASS_KEY)])
         self.charm.singleton.install.assert_called_once_with()
         self.set_state.assert_called_once_with('charm.installed')
 
@@ -267,10 +423,12 @@ class TestDefaults(BaseOpenStackCharmTest):
         self.patch_object(chm, 'register_os_release_selector')
         h = self.mock_decorator_gen_simple()
         self.register_os_release_selector.side_effect = h.decorator
+        self.patch_object(chm, '_default_release_selector', new=None)
         # call the default handler installer function, and check its map.
         f = chm._default_handler_map['charm.default-select-release']
         f()
         self.assertIsNotNone(h.map['function'])
+        self.assertIsNotNone(chm._default_release_selector)
         # verify that the installed function works
         kv = mock.MagicMock()
         self.patch_object(chm.unitdata, 'kv', new=lambda: kv)
@@ -500,7 +658,8 @@ class TestOpenStackCharm(BaseOpenStackCharmTest):
         self.patch_object(chm.subprocess, 'check_output', return_value=b'\n')
         self.target.install()
         self.target.set_state.assert_called_once_with('charmname-installed')
-        self.fip.assert_called_once_with([])
+        # there are no packages, so there is nothing to look up
+        self.fip.assert_not_called()
 
     def test_all_packages(self):
         self.assertEqual(self.target.packages, self.target.all_packages)
@@ -508,6 +667,19 @@ class TestOpenStackCharm(BaseOpenStackCharmTest):
     def test_full_restart_map(self):
         self.assertEqual(self.target.full_restart_map, self.target.restart_map)
 
+    def test_cached_per_hook(self):
+        self.patch_target('packages', new=['pkg1'])
+        packages = self.target.all_packages
+        packages.append('pkg2')
+        # callers get a copy, so the cache and the class aren't modified
+        self.assertEqual(self.target.all_packages, ['pkg1'])
+        self.assertEqual(self.target.packages, ['pkg1'])
+        self.target.packages = ['pkg3']
+        self.assertEqual(self.target.all_packages, ['pkg1'])
+        self.patch_object(chm.reactive.bus, 'set_state')
+        self.target.set_state('a-state')
+        self.assertEqual(self.target.all_packages, ['pkg3'])
+
     def test_set_state(self):
         # tests that OpenStackCharm.set_state() calls set_state() global
         self.patch_object(chm.reactive.bus, 'set_state')
@@ -516,6 +688,10 @@ class TestOpenStackCharm(BaseOpenStackCharmTest):
         self.set_state.reset_mock()
         self.target.set_state('hello', 'there')
         self.set_state.assert_called_once_with('hello', 'there')
+        # the resolved addresses don't depend on the states
+        self.patch_object(chm.os_ip, 'flush_address_cache')
+        self.target.set_state('hello')
+        self.flush_address_cache.assert_not_called()
 
     def test_remove_state(self):
         # tests that OpenStackCharm.remove_state() calls remove_state() global
@@ -529,9 +705,30 @@ class TestOpenStackCharm(BaseOpenStackCharmTest):
                           name='cis')
         self.patch_object(chm.charmhelpers.fetch, 'apt_update')
         self.patch_target('config', new={'openstack-origin': 'an-origin'})
+        self.patch_object(chm, '_apt_cache', new=mock.MagicMock())
         self.target.configure_source()
         self.cis.assert_called_once_with('an-origin')
         self.apt_update.assert_called_once_with(fatal=True)
+        self.assertIsNone(chm._apt_cache)
+
+    def test_configure_source_fresh(self):
+        self._patch_kv()
+        self.patch_object(chm.os_utils, 'configure_installation_source')
+        self.patch_object(chm.charmhelpers.fetch, 'apt_update')
+        self.patch_object(chm, 'apt_sources_digest', return_value='abc')
+        self.patch_object(chm.time, 'time', return_value=1000.0)
+        self.patch_target('config', new={'openstack-origin': 'an-origin'})
+        self.target.configure_source()
+        # a later hook within the default hour doesn't update again
+        chm._install_planner = None
+        self.time.return_value = 1000.0 + 30 * 60
+        self.target.configure_source()
+        self.apt_update.assert_called_once_with(fatal=True)
+        # ... but one after it does
+        chm._install_planner = None
+        self.time.return_value = 1000.0 + 61 * 60
+        self.target.configure_source()
+        self.assertEqual(self.apt_update.call_count, 2)
 
     def test_region(self):
         self.patch_target('config', new={'region': 'a-region'})
@@ -566,6 +763,7 @@ class TestOpenStackCharm(BaseOpenStackCharmTest):
             # test with path1 and path3 restarts
             for k in ['path1', 'path3']:
                 hashs[k] += 1
+        # the restarts are done as the context manager exits
         self.assertEqual(self.service_stop.call_count, 2)
         self.assertEqual(self.service_start.call_count, 2)
         self.service_stop.assert_any_call('s1')
@@ -582,15 +780,116 @@ class TestOpenStackCharm(BaseOpenStackCharmTest):
         self.assertEqual(self.service_stop.call_count, 2)
         self.assertEqual(self.service_start.call_count, 2)
         calls = [mock.call('s2'), mock.call('s4')]
-        self.service_stop.assert_has_calls(calls)
-        self.service_start.assert_has_calls(calls)
+        self.service_stop.assert_has_calls(calls, any_order=True)
+        self.service_start.assert_has_calls(calls, any_order=True)
+
+        # nested passes restart once, when the outermost one exits
+        self.service_stop.reset_mock()
+        self.service_start.reset_mock()
+        with self.target.restart_on_change():
+            with self.target.restart_on_change():
+                hashs['path2'] += 1
+            self.service_stop.assert_not_called()
+            hashs['path4'] += 1
+        self.assertEqual(self.service_stop.call_count, 2)
+        self.service_stop.assert_has_calls(calls, any_order=True)
+
+        # if the wrapped code fails, nothing is restarted or left pending
+        self.service_stop.reset_mock()
+        with self.assertRaises(RuntimeError):
+            with self.target.restart_on_change():
+                hashs['path1'] += 1
+                raise RuntimeError()
+        self.service_stop.assert_not_called()
+        self.assertEqual(chm.get_restart_scheduler().pending, [])
+        with self.target.restart_on_change():
+            pass
+        self.service_stop.assert_not_called()
+
+    def test_restart_on_change_reads_map_once(self):
+        self.patch_object(chm.ch_host, 'path_hash', return_value=1)
+        restart_map = mock.PropertyMock(
+            return_value={'path1': ['s1'], 'path2': ['s2']})
+        with mock.patch.object(chm.OpenStackCharm, 'full_restart_map',
+                               new=restart_map):
+            with self.target.restart_on_change():
+                pass
+        restart_map.assert_called_once_with()
 
     def test_restart_all(self):
-        self.patch_object(chm.ch_host, 'service_restart')
+        self.patch_object(chm.ch_host, 'service_stop')
+        self.patch_object(chm.ch_host, 'service_start')
         self.patch_target('services', new=['s1', 's2'])
+        self.target.schedule_restart(['s1'])
         self.target.restart_all()
-        self.assertEqual(self.service_restart.call_args_list,
+        # the restarts happen straight away, and s1 is only restarted once
+        self.assertEqual(sorted(self.service_stop.call_args_list),
                          [mock.call('s1'), mock.call('s2')])
+        self.assertEqual(sorted(self.service_start.call_args_list),
+                         [mock.call('s1'), mock.call('s2')])
+        self.assertEqual(chm.get_restart_scheduler().pending, [])
+
+    def test_restart_on_change_actions(self):
+        hashs = {'path1': 100, 'path2': 200, 'path3': 300}
+        self.patch_target('restart_map', new={
+            'path1': ['s1', 's2'],
+            'path2': ['s2', 's3'],
+            'path3': ['s3'],
+        })
+        self.patch_target('restart_actions', new={
+            's1': 'reload',
+            's2': 'reload',
+            's3': 'reload',
+            'path3': ['s3-ctl', 'refresh'],
+        })
+        self.patch_object(chm.ch_host, 'path_hash')
+        self.path_hash.side_effect = lambda x: hashs[x]
+        self.patch_object(chm.ch_host, 'service_stop')
+        self.patch_object(chm.ch_host, 'service_start')
+        self.patch_object(chm.ch_host, 'service_reload')
+        self.patch_object(chm.subprocess, 'check_call')
+        with self.target.restart_on_change():
+            for k in hashs.keys():
+                hashs[k] += 1
+        self.service_stop.assert_not_called()
+        self.service_start.assert_not_called()
+        self.service_reload.assert_has_calls(
+            [mock.call('s1', restart_on_failure=True),
+             mock.call('s2', restart_on_failure=True)], any_order=True)
+        self.assertEqual(self.service_reload.call_count, 2)
+        self.check_call.assert_called_once_with(['s3-ctl', 'refresh'])
+
+    def test_restart_scheduler_action(self):
+        scheduler = chm.RestartScheduler()
+        scheduler.schedule(['a', 'b', 'c', 'd'], action='reload')
+        scheduler.schedule(['b'])
+        scheduler.schedule(['c', 'd'], action=['c', 'cmd'])
+        scheduler.schedule(['d'], action=['d', 'cmd'])
+        self.assertEqual(scheduler.action('a'), 'reload')
+        self.assertEqual(scheduler.action('b'), 'restart')
+        self.assertEqual(scheduler.action('c'), ('c', 'cmd'))
+        self.assertEqual(scheduler.action('d'), 'restart')
+        with self.assertRaises(ValueError):
+            scheduler.schedule(['a'], action='bounce')
+
+    def test_restart_dependencies(self):
+        self.patch_object(chm.ch_host, 'service_stop')
+        self.patch_object(chm.ch_host, 'service_start')
+        self.patch_target('restart_dependencies',
+                          new={'api': ['scheduler'],
+                               'scheduler': ['conductor']})
+        self.target.schedule_restart(['api', 'conductor', 'other'])
+        self.target.schedule_restart(['scheduler'])
+        self.assertEqual(chm.get_restart_scheduler().levels(),
+                         [['conductor', 'other'], ['scheduler'], ['api']])
+        chm.flush_restarts()
+        stops = [c[0][0] for c in self.service_stop.call_args_list]
+        starts = [c[0][0] for c in self.service_start.call_args_list]
+        self.assertEqual(stops[:2], ['api', 'scheduler'])
+        self.assertEqual(sorted(stops[2:]), ['conductor', 'other'])
+        self.assertEqual(sorted(starts[:2]), ['conductor', 'other'])
+        self.assertEqual(starts[2:], ['scheduler', 'api'])
+        self.assertEqual(chm.get_restart_scheduler().pending, [])
 
     def test_db_sync_done(self):
         self.patch_object(chm.hookenv, 'leader_get')
@@ -655,10 +954,10 @@ class TestOpenStackAPICharm(BaseOpenStackCharmTest):
         self.target.install()
         # self.target.set_state.assert_called_once_with('charmname-installed')
         self.target.configure_source.assert_called_once_with()
-        self.fip.assert_called_once_with([])
+        self.fip.assert_not_called()
 
     def test_setup_token_cache(self):
-        self.patch_target('token_cache_pkgs')
+        self.patch_target('token_cache_pkgs', return_value=['memcached'])
         self.patch_target('install')
         self.patch_object(chm.charmhelpers.fetch,
                           'filter_installed_packages',
@@ -680,7 +979,11 @@ class TestOpenStackAPICharm(BaseOpenStackCharmTest):
                           name='gocis')
         self.gocis.return_value = 'liberty'
         self.assertFalse(self.target.enable_memcache())
+        # the codename is cached for the origin
         self.gocis.return_value = 'newton'
+        self.assertFalse(self.target.enable_memcache())
+        self.gocis.assert_called_once_with('distro')
+        chm.os_release_data.flush_release_cache()
         self.assertTrue(self.target.enable_memcache())
 
     def test_token_cache_pkgs(self):
@@ -708,6 +1011,10 @@ class TestOpenStackAPICharm(BaseOpenStackCharmTest):
         self.assertEqual(self.target.all_packages,
                          ['pkg1', 'pkg2', 'memcached', 'python-memcache'])
         self.enable_memcache.return_value = False
+        # the value is memoized until the cache is invalidated
+        self.assertEqual(self.target.all_packages,
+                         ['pkg1', 'pkg2', 'memcached', 'python-memcache'])
+        self.target.invalidate_cache()
         self.assertEqual(self.target.all_packages, ['pkg1', 'pkg2'])
 
     def test_full_restart_map(self):
@@ -722,6 +1029,7 @@ class TestOpenStackAPICharm(BaseOpenStackCharmTest):
                           'conf2': ['svc1'],
                           '/etc/memcached.conf': ['memcached']})
         self.enable_memcache.return_value = False
+        self.target.invalidate_cache()
         self.assertEqual(self.target.full_restart_map, base_restart_map)
 
 
@@ -743,6 +1051,7 @@ class TestHAOpenStackCharm(BaseOpenStackCharmTest):
         self.token_cache_pkgs.return_value = ['memcache']
         self.haproxy_enabled.return_value = True
         self.apache_enabled.return_value = True
+        self.target.invalidate_cache()
         self.assertEqual(['pkg1', 'memcache', 'haproxy', 'apache2'],
                          self.target.all_packages)
 
@@ -805,9 +1114,9 @@ class TestHAOpenStackCharm(BaseOpenStackCharmTest):
         interface_mock = mock.Mock()
         self.patch_target('name', new='myservice')
         self.patch_target('config', new={'vip': 'vip1 vip2'})
-        self.patch_object(chm.ch_ip, 'get_iface_for_address')
+        self.patch_object(chm.os_ip, 'get_iface_for_address')
         self.get_iface_for_address.side_effect = lambda x: ifaces[x]
-        self.patch_object(chm.ch_ip, 'get_netmask_for_address')
+        self.patch_object(chm.os_ip, 'get_netmask_for_address')
         self.get_netmask_for_address.side_effect = lambda x: masks[x]
         self.target._add_ha_vips_config(interface_mock)
         calls = [
@@ -823,8 +1132,8 @@ class TestHAOpenStackCharm(BaseOpenStackCharmTest):
         interface_mock = mock.Mock()
         self.patch_target('name', new='myservice')
         self.patch_target('config', new=config)
-        self.patch_object(chm.ch_ip, 'get_iface_for_address')
-        self.patch_object(chm.ch_ip, 'get_netmask_for_address')
+        self.patch_object(chm.os_ip, 'get_iface_for_address')
+        self.patch_object(chm.os_ip, 'get_netmask_for_address')
         self.get_iface_for_address.return_value = None
         self.get_netmask_for_address.return_value = None
         self.target._add_ha_vips_config(interface_mock)
@@ -883,7 +1192,8 @@ class TestHAOpenStackCharm(BaseOpenStackCharmTest):
             'ssl': 0,
             'proxy': 0,
             'proxy_http': 1}
-        self.patch_object(chm.ch_host, 'service_restart')
+        self.patch_target('schedule_restart')
+        self.patch_object(chm, 'flush_restarts')
         self.patch_object(chm.subprocess, 'check_call')
         self.patch_object(
             chm.subprocess, 'call',
@@ -891,7 +1201,8 @@ class TestHAOpenStackCharm(BaseOpenStackCharmTest):
         self.target.enable_apache_modules()
         self.check_call.assert_called_once_with(
             ['a2enmod', 'proxy_http'])
-        self.service_restart.assert_called_once_with('apache2')
+        self.schedule_restart.assert_called_once_with(['apache2'])
+        self.flush_restarts.assert_called_once_with()
 
     def test_configure_cert(self):
         self.patch_object(chm.ch_host, 'mkdir')
@@ -1233,26 +1544,63 @@ class TestMyOpenStackCharm(BaseOpenStackCharmTest):
                 'admin': 3,
             },
         }
-        test_ports = [4, 5, 6]
+        test_ports = [4, 5, 7]
         self.target.update_api_ports(test_ports)
-        calls = [mock.call(4), mock.call(5), mock.call(6)]
-        self.open_port.assert_has_calls(calls)
+        self.open_port.assert_has_calls([mock.call('4-5', 'TCP'),
+                                         mock.call('7', 'TCP')])
         self.open_port.reset_mock()
         self.target.update_api_ports()
-        calls = [mock.call(1), mock.call(2), mock.call(3)]
-        self.open_port.assert_has_calls(calls)
+        self.open_port.assert_called_once_with('1-3', 'TCP')
         self.close_port.assert_not_called()
         # now check that it doesn't open ports already open and closes ports
-        # that should be closed
+        # that should be closed; udp ports aren't touched.
         self.open_port.reset_mock()
         self.close_port.reset_mock()
         self.check_output.return_value = b"1/tcp\n2/tcp\n3/udp\n4/tcp\n"
         # port 3 should be opened, port 4 should be closed.
-        open_calls = [mock.call(3)]
-        close_calls = [mock.call(4)]
         self.target.update_api_ports()
-        self.open_port.asset_has_calls(open_calls)
-        self.close_port.assert_has_calls(close_calls)
+        self.open_port.assert_called_once_with('3', 'TCP')
+        self.close_port.assert_called_once_with('4', 'TCP')
+        # a range with an unwanted port is closed and its wanted ports are
+        # re-opened; closes happen before opens.
+        manager = mock.MagicMock()
+        manager.attach_mock(self.open_port, 'open_port')
+        manager.attach_mock(self.close_port, 'close_port')
+        manager.reset_mock()
+        self.check_output.return_value = b"1-4/tcp\n53/udp\n"
+        self.target.update_api_ports(['1-3', '53/udp', '60-61/udp'])
+        self.assertEqual(manager.mock_calls, [
+            mock.call.close_port('1-4', 'TCP'),
+            mock.call.open_port('1-3', 'TCP'),
+            mock.call.open_port('60-61', 'UDP'),
+        ])
+
+    def test_update_api_ports_unchanged(self):
+        self.patch_object(chm.hookenv, 'open_port')
+        self.patch_object(chm.hookenv, 'close_port')
+        self.patch_object(chm.subprocess, 'check_output',
+                          return_value=b'1-2/tcp\n')
+        self.target.update_api_ports([2, 1])
+        self.open_port.assert_not_called()
+        self.close_port.assert_not_called()
+        # a port closed outside of update_api_ports() is opened again
+        self.check_output.return_value = b'1/tcp\n'
+        self.target.update_api_ports([2, 1])
+        self.open_port.assert_called_once_with('2', 'TCP')
+        self.close_port.assert_not_called()
+
+    def test_parse_port_spec(self):
+        self.assertEqual(chm.parse_port_spec(80), {(80, 'tcp')})
+        self.assertEqual(chm.parse_port_spec('53/UDP'), {(53, 'udp')})
+        self.assertEqual(chm.parse_port_spec('8000-8002', protocol='udp'),
+                         {(8000, 'udp'), (8001, 'udp'), (8002, 'udp')})
+
+    def test_compress_ports(self):
+        self.assertEqual(
+            chm.compress_ports({(1, 'tcp'), (2, 'tcp'), (3, 'tcp'),
+                                (5, 'tcp'), (2, 'udp')}),
+            [['1-3', 'tcp'], ['5', 'tcp'], ['2', 'udp']])
+        self.assertEqual(chm.compress_ports(set()), [])
 
     def test_opened_ports(self):
         self.patch_object(chm.subprocess, 'check_output')
@@ -1288,6 +1636,56 @@ class TestMyOpenStackCharm(BaseOpenStackCharmTest):
         self.assertEqual(self.target.internal_url, 'my-ip-address:3579')
         self.canonical_url.assert_called_once_with(chm.os_ip.INTERNAL)
 
+    def test_singleton_cached_release_class(self):
+        store = self._patch_kv()
+        self.patch_object(chm, 'dpkg_status_fingerprint',
+                          return_value=[100.0, 2000])
+        self.patch_object(chm, '_release_selector_function',
+                          new=mock.MagicMock(return_value='icehouse'))
+        # only the default release selector's choice is persisted
+        self.patch_object(chm, '_default_release_selector',
+                          new=chm._release_selector_function)
+        s = self.target.singleton
+        self.assertEqual(s.release, 'icehouse')
+        self.assertEqual(store[chm.RELEASE_CLASS_KEY],
+                         {'release': 'icehouse',
+                          'class': 'MyOpenStackCharm',
+                          'fingerprint': [100.0, 2000, None]})
+        # the next hook skips the release selection
+        chm._singleton = None
+        s = self.target.singleton
+        self.assertEqual(s.release, 'icehouse')
+        self.assertIs(s.__class__, MyOpenStackCharm)
+        chm._release_selector_function.assert_called_once_with()
+        # a package change means the release is selected again
+        chm._singleton = None
+        self.dpkg_status_fingerprint.return_value = [200.0, 2000]
+        chm._release_selector_function.return_value = 'mitaka'
+        self.assertIsInstance(self.target.singleton, MyNextOpenStackCharm)
+        self.assertEqual(chm._release_selector_function.call_count, 2)
+        # as does invalidating it
+        chm._singleton = None
+        chm.invalidate_release_class()
+        self.assertNotIn(chm.RELEASE_CLASS_KEY, store)
+
+    def test_singleton_custom_release_selector(self):
+        store = self._patch_kv()
+        self.patch_object(chm, 'dpkg_status_fingerprint',
+                          return_value=[100.0, 2000])
+        self.patch_object(chm, '_release_selector_function',
+                          new=mock.MagicMock(return_value='icehouse'))
+        self.patch_object(chm, '_default_release_selector',
+                          new=mock.MagicMock())
+        store[chm.RELEASE_CLASS_KEY] = {
+            'release': 'mitaka',
+            'class': 'MyNextOpenStackCharm',
+            'fingerprint': [100.0, 2000, None]}
+        self.assertEqual(self.target.singleton.release, 'icehouse')
+        chm._singleton = None
+        self.assertEqual(self.target.singleton.release, 'icehouse')
+        self.assertEqual(chm._release_selector_function.call_count, 2)
+        self.assertEqual(store[chm.RELEASE_CLASS_KEY]['release'], 'mitaka')
+
     def test_application_version_unspecified(self):
         self.patch_object(chm.os_utils, 'os_release')
         self.patch_object(chm, 'get_upstream_version',
@@ -1312,6 +1710,40 @@ class TestMyOpenStackCharm(BaseOpenStackCharmTest):
         self.get_upstream_version.assert_called_once_with('p2')
         self.os_release.assert_called_once_with('p2')
 
+    def test_application_version_cached(self):
+        store = self._patch_kv()
+        self.patch_object(chm.os_utils, 'os_release')
+        self.patch_object(chm, 'get_upstream_version',
+                          return_value='1.2.3')
+        self.patch_object(chm, 'dpkg_status_fingerprint',
+                          return_value=[100.0, 2000])
+        self.assertEqual(self.target.application_version, '1.2.3')
+        self.assertEqual(self.target.application_version, '1.2.3')
+        self.get_upstream_version.assert_called_once_with('p2')
+        self.assertEqual(store[chm.APPLICATION_VERSION_KEY],
+                         {'package': 'p2',
+                          'fingerprint': [100.0, 2000],
+                          'version': '1.2.3'})
+        # a package change invalidates the cached version
+        self.dpkg_status_fingerprint.return_value = [200.0, 2000]
+        self.get_upstream_version.return_value = '1.2.4'
+        self.assertEqual(self.target.application_version, '1.2.4')
+        self.assertEqual(self.get_upstream_version.call_count, 2)
+        # without a fingerprint nothing is cached
+        self.dpkg_status_fingerprint.return_value = None
+        self.target.application_version
+        self.target.application_version
+        self.assertEqual(self.get_upstream_version.call_count, 4)
+
+    def test_dpkg_status_fingerprint(self):
+        self.patch_object(chm.os, 'stat', return_value=mock.MagicMock())
+        self.stat.return_value.st_mtime = 100.0
+        self.stat.return_value.st_size = 2000
+        self.assertEqual(chm.dpkg_status_fingerprint(), [100.0, 2000])
+        self.stat.assert_called_once_with(chm.DPKG_STATUS)
+        self.stat.side_effect = OSError()
+        self.assertIsNone(chm.dpkg_status_fingerprint())
+
     def test_render_all_configs(self):
         self.patch_target('render_configs')
         self.target.render_all_configs()
@@ -1348,6 +1780,21 @@ class TestMyOpenStackCharm(BaseOpenStackCharmTest):
         assert isinstance(context, MyAdapter)
         self.assertEqual(context.interfaces, ['interface1', 'interface2'])
 
+    def test_render_configs_freezes_adapters(self):
+        self.patch_object(chm.charmhelpers.core.templating, 'render')
+        self.patch_object(chm.os_templating,
+                          'get_loader',
+                          return_value='my-loader')
+        self.patch_object(chm.ch_host, 'path_hash', return_value='hash')
+        adapters_instance = chm.os_adapters.OpenStackRelationAdapters([])
+        self.target.render_configs(['path1', 'path2'],
+                                   adapters_instance=adapters_instance)
+        contexts = [c[1]['context'] for c in self.render.call_args_list]
+        self.assertEqual(len(contexts), 2)
+        # the same snapshot is shared by all the templates in the pass
+        self.assertIsInstance(contexts[0], chm.os_adapters.FrozenAdapter)
+        self.assertIs(contexts[0], contexts[1])
+
     def test_render_configs_singleton_render_with_interfaces(self):
         self.patch_object(chm.charmhelpers.core.templating, 'render')
         self.patch_object(chm.os_templating,
@@ -1460,15 +1907,98 @@ class TestMyOpenStackCharm(BaseOpenStackCharmTest):
         self.custom_assess_status_check.assert_called_once_with()
         self.check_services_running.assert_called_once_with()
 
+    def test_assess_status_version_unchanged(self):
+        self._patch_kv()
+        self.patch_object(chm.hookenv, 'status_set')
+        self.patch_object(chm.hookenv, 'application_version_set')
+        self.patch_target('check_if_paused', return_value=(None, None))
+        self.patch_target('check_interfaces', return_value=(None, None))
+        self.patch_target('custom_assess_status_check',
+                          return_value=(None, None))
+        self.patch_target('check_services_running', return_value=(None, None))
+        self.patch_object(chm, 'get_upstream_version',
+                          return_value='1.2.3')
+        self.patch_object(chm, 'dpkg_status_fingerprint',
+                          return_value=[100.0, 2000])
+        self.target.assess_status()
+        self.target.assess_status()
+        self.application_version_set.assert_called_once_with('1.2.3')
+        self.get_upstream_version.assert_called_once_with('p2')
+        # the packages changed, so the version is looked up again
+        self.get_upstream_version.return_value = '1.2.4'
+        self.dpkg_status_fingerprint.return_value = [200.0, 2100]
+        self.target.assess_status()
+        self.application_version_set.assert_called_with('1.2.4')
+        self.assertEqual(self.get_upstream_version.call_count, 2)
+
     def test_assess_status_paused(self):
         self.patch_object(chm.hookenv, 'status_set')
         self.patch_object(chm.hookenv, 'application_version_set')
-        # patch out _ows_check_if_paused
         self.patch_object(chm.os_utils, '_ows_check_if_paused',
-                          return_value=('paused', '123'))
+                          return_value=('maintenance', 'Paused'))
+        self.patch_target('ports_to_check', return_value=[1, 2])
         self.target.assess_status()
-        self.status_set.assert_called_once_with('paused', '123')
+        self.status_set.assert_called_once_with('maintenance', 'Paused')
         self.application_version_set.assert_called_once_with(mock.ANY)
+        self._ows_check_if_paused.assert_called_once_with(
+            services=self.target.services, ports=[1, 2])
+
+    def test_assess_status_probes_once(self):
+        self.patch_object(chm.hookenv, 'status_set')
+        self.patch_object(chm.hookenv, 'application_version_set')
+        self.patch_object(chm.os_utils, '_ows_check_if_paused',
+                          return_value=(None, None))
+        self.patch_object(chm.os_utils, '_ows_check_services_running')
+        self.patch_target('check_interfaces', return_value=(None, None))
+        self.patch_object(chm.ch_host, 'service_running', return_value=True)
+        self.patch_object(chm, 'probe_ports',
+                          return_value={1, 2, 3, 1234, 2468, 3579})
+        self.target.assess_status()
+        self.status_set.assert_called_once_with('active', 'Unit is ready')
+        self._ows_check_if_paused.assert_called_once_with(
+            services=self.target.services,
+            ports=[1, 2, 3, 1234, 2468, 3579])
+        self._ows_check_services_running.assert_not_called()
+        self.assertEqual(self.service_running.call_count, 2)
+        self.probe_ports.assert_called_once_with(
+            [1, 2, 3, 1234, 2468, 3579], timeout=1.0)
+        # outside of assess_status() the probes aren't cached
+        self.target.check_services_running()
+        self.assertEqual(self.probe_ports.call_count, 2)
+
+    def test_assess_status_skips_unchanged_status(self):
+        store = self._patch_kv()
+        self.patch_object(chm.hookenv, 'status_set')
+        self.patch_object(chm.hookenv, 'application_version_set')
+        self.patch_object(chm.hookenv, 'hook_name',
+                          return_value='update-status')
+        self.patch_target('check_if_paused', return_value=(None, None))
+        self.patch_target('check_interfaces', return_value=(None, None))
+        self.patch_target('check_services_running', return_value=(None, None))
+        self.target.assess_status()
+        self.target.assess_status()
+        self.status_set.assert_called_once_with('active', 'Unit is ready')
+        self.assertEqual(store[chm.WORKLOAD_STATUS_KEY],
+                         ['active', 'Unit is ready'])
+        self.patch_target('check_services_running',
+                          return_value=('blocked', 'oops'))
+        self.target.assess_status()
+        self.status_set.assert_called_with('blocked', 'oops')
+        # a status set elsewhere through status_set() is recorded too
+        chm.status_set('maintenance', 'Running openstack upgrade')
+        self.target.assess_status()
+        self.status_set.assert_called_with('blocked', 'oops')
+        self.assertEqual(self.status_set.call_count, 4)
+        # other hooks always set the status
+        self.hook_name.return_value = 'config-changed'
+        self.target.assess_status()
+        self.assertEqual(self.status_set.call_count, 5)
+
+    def test_check_if_paused(self):
+        self.patch_object(chm.os_utils, '_ows_check_if_paused',
+                          return_value=('blocked', 'Services running'))
+        self.assertEqual(self.target.check_if_paused(),
+                         ('blocked', 'Services running'))
         self._ows_check_if_paused.assert_called_once_with(
             services=self.target.services,
             ports=[1, 2, 3, 1234, 2468, 3579])
@@ -1538,17 +2068,70 @@ class TestMyOpenStackCharm(BaseOpenStackCharmTest):
         }
         self.assertEqual(self.target.check_interfaces(), (None, None))
 
+    def test_state_check_plan(self):
+        self.patch_target('required_relations', new=['rel1'])
+        plan = self.target.state_check_plan()
+        self.assertEqual(
+            plan,
+            (('rel1', (('rel1.connected', 'blocked', "'rel1' missing"),
+                       ('rel1.available', 'waiting', "'rel1' incomplete"))),))
+        # the default plan is shared by instances of the class
+        other = self.target.__class__()
+        other.required_relations = ['rel1']
+        self.assertIs(other.state_check_plan(), plan)
+        # an overridden states_to_check() is used, and cached per hook
+        self.patch_target('states_to_check',
+                          return_value={'rel2': [('rel2.joined', 'blocked',
+                                                  'no rel2')]})
+        plan = self.target.state_check_plan()
+        self.assertEqual(plan,
+                         (('rel2', (('rel2.joined', 'blocked', 'no rel2'),)),))
+        self.assertIs(self.target.state_check_plan(), plan)
+        self.target.invalidate_cache()
+        self.assertIsNot(self.target.state_check_plan(), plan)
+        self.assertEqual(self.states_to_check.call_count, 2)
+
+    def test_evaluate_state_check_plan(self):
+        self.patch_object(chm.os_utils, 'workload_state_compare',
+                          new=lambda x, y: y if x is None else min(x, y))
+        plan = (('rel1', (('rel1.connected', 'blocked', "'rel1' missing"),
+                          ('rel1.available', 'waiting', "'rel1' incomplete"))),
+                ('rel2', (('rel2.connected', 'blocked', "'rel2' missing"),)))
+        self.assertEqual(
+            chm.evaluate_state_check_plan(plan, {'rel1.connected'}),
+            ('blocked', "'rel1' incomplete, 'rel2' missing"))
+        self.assertEqual(
+            chm.evaluate_state_check_plan(
+                plan, {'rel1.connected', 'rel1.available', 'rel2.connected'}),
+            (None, None))
+
     def test_check_assess_status_check_services_running(self):
-        # verify that the function calls _ows_check_services_running() with the
-        # valid information
         self.patch_object(chm.os_utils, '_ows_check_services_running',
-                          return_value=('active', 'that'))
-        status, message = self.target.check_services_running()
-        self.assertEqual((status, message), ('active', 'that'))
+                          return_value=('blocked', 'Services not running'))
+        self.patch_target('probe_services_and_ports')
+        self.probe_services_and_ports.return_value = (
+            [('svc1', True), ('svc2', True)], [(1, True), (2, True)])
+        self.assertEqual(self.target.check_services_running(), (None, None))
+        self._ows_check_services_running.assert_not_called()
+        self.probe_services_and_ports.return_value = (
+            [('svc1', False), ('svc2', True)], [(1, True), (2, False)])
+        self.assertEqual(self.target.check_services_running(),
+                         ('blocked', 'Services not running'))
         self._ows_check_services_running.assert_called_once_with(
             services=['my-default-service', 'my-second-service'],
             ports=[1, 2, 3, 1234, 2468, 3579])
 
+    def test_probe_services_and_ports(self):
+        self.patch_object(chm.ch_host, 'service_running')
+        self.service_running.side_effect = \
+            lambda s: s == 'my-default-service'
+        self.patch_object(chm, 'probe_ports', return_value={2, 3579})
+        self.assertEqual(
+            self.target.probe_services_and_ports(),
+            ([('my-default-service', True), ('my-second-service', False)],
+             [(1, False), (2, True), (3, False), (1234, False),
+              (2468, False), (3579, True)]))
+
     def test_check_ports_to_check(self):
         ports = {
             's1': {'k1': 3, 'k2': 4, 'k3': 5},
@@ -1614,6 +2197,13 @@ class TestMyOpenStackCharm(BaseOpenStackCharmTest):
         self.patch_target('do_openstack_pkg_upgrade')
         self.patch_target('do_openstack_upgrade_config_render')
         self.patch_target('do_openstack_upgrade_db_migration')
+        manager = mock.MagicMock()
+        self.patch_object(chm, 'flush_restarts')
+        manager.attach_mock(self.flush_restarts, 'flush_restarts')
+        manager.attach_mock(self.do_openstack_upgrade_config_render,
+                            'render')
+        manager.attach_mock(self.do_openstack_upgrade_db_migration,
+                            'migrate')
         # Test no upgrade avaialble
         self.openstack_upgrade_available.return_value = False
         self.target.upgrade_if_available('int_list')
@@ -1630,6 +2220,11 @@ class TestMyOpenStackCharm(BaseOpenStackCharmTest):
         self.do_openstack_upgrade_config_render.assert_called_once_with(
             'int_list')
         self.do_openstack_upgrade_db_migration.assert_called_once_with()
+        # services are restarted onto the new config before the migration
+        self.assertEqual(manager.mock_calls, [
+            mock.call.render('int_list'),
+            mock.call.flush_restarts(),
+            mock.call.migrate()])
 
     def test_do_openstack_pkg_upgrade(self):
         self.patch_target('config',
@@ -1643,7 +2238,8 @@ class TestMyOpenStackCharm(BaseOpenStackCharmTest):
         self.target.do_openstack_pkg_upgrade()
         self.configure_installation_source.assert_called_once_with(
             'cloud:natty-kilo')
-        self.apt_update.assert_called_once_with()
+        # the upgrade path doesn't fail the hook if apt_update fails
+        self.apt_update.assert_called_once_with(fatal=False)
         self.apt_upgrade.assert_called_once_with(
             dist=True, fatal=True,
             options=[
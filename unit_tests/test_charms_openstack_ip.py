@@ -50,10 +50,125 @@ class TestCharmOpenStackIp(utils.BaseTestCase):
         url = ip.canonical_url(ip.INTERNAL)
         self.resolve_address.assert_called_once_with(ip.INTERNAL)
 
+    def test_resolve_address_cached(self):
+        self.patch_object(ip, '_resolve_address', return_value='addr1')
+        self.patch_object(ip.hookenv, 'config')
+        _config = {'vip': None}
+        self.config.side_effect = lambda k: _config.get(k)
+        ip.flush_address_cache()
+        stats = ip.address_cache_stats()
+        self.assertEqual(ip.resolve_address(), 'addr1')
+        self.assertEqual(ip.resolve_address(), 'addr1')
+        self.assertEqual(ip.resolve_address(ip.INTERNAL), 'addr1')
+        self.assertEqual(ip.resolve_address(ip.INTERNAL, False), 'addr1')
+        self.assertEqual(self._resolve_address.call_count, 3)
+        # a config change means the address is resolved again
+        _config['vip'] = 'vip1'
+        self.assertEqual(ip.resolve_address(), 'addr1')
+        self.assertEqual(self._resolve_address.call_count, 4)
+        # as does flushing the cache
+        ip.flush_address_cache()
+        self.assertEqual(ip.resolve_address(), 'addr1')
+        self.assertEqual(self._resolve_address.call_count, 5)
+        new_stats = ip.address_cache_stats()
+        self.assertEqual(new_stats['hits'] - stats['hits'], 1)
+        self.assertEqual(new_stats['misses'] - stats['misses'], 5)
+        ip.flush_address_cache()
+
+    def test_interface_lookups(self):
+        self.patch_object(ip.net_ip, 'get_address_in_network',
+                          return_value='10.0.0.5')
+        self.patch_object(ip.net_ip, 'get_netmask_for_address',
+                          return_value='255.255.255.0')
+        self.patch_object(ip.net_ip, 'get_iface_for_address',
+                          return_value='eth0')
+        self.addCleanup(ip.flush_address_cache)
+        ip.flush_address_cache()
+        for _ in range(2):
+            self.assertEqual(ip.get_address_in_network('10.0.0.0/24'),
+                             '10.0.0.5')
+            self.assertEqual(ip.get_netmask_for_address('10.0.0.5'),
+                             '255.255.255.0')
+            self.assertEqual(ip.get_iface_for_address('10.0.0.5'), 'eth0')
+        self.get_address_in_network.assert_called_once_with(
+            '10.0.0.0/24', None)
+        self.get_netmask_for_address.assert_called_once_with('10.0.0.5')
+        self.get_iface_for_address.assert_called_once_with('10.0.0.5')
+        ip.get_address_in_network('10.0.0.0/24', 'fallback')
+        self.assertEqual(self.get_address_in_network.call_count, 2)
+        ip.flush_address_cache()
+        ip.get_iface_for_address('10.0.0.5')
+        self.assertEqual(self.get_iface_for_address.call_count, 2)
+
+    def test_vip_matcher(self):
+        self.patch_object(ip.net_ip, 'is_address_in_network')
+        matcher = ip.VIPMatcher(['10.0.0.10', '2001:db8::10', '10.1.0.10'])
+        self.assertEqual(matcher.match(['10.1.0.0/24']), '10.1.0.10')
+        self.assertEqual(matcher.match(['2001:db8::/64', '10.1.0.0/24']),
+                         '2001:db8::10')
+        self.assertIsNone(matcher.match(['192.168.0.0/24']))
+        self.is_address_in_network.assert_not_called()
+        # anything that can't be parsed falls back to is_address_in_network
+        self.is_address_in_network.side_effect = (
+            lambda cidr, vip: vip == '10.1.0.10')
+        self.assertEqual(matcher.match(['a-network']), '10.1.0.10')
+
+    def test_get_binding_info(self):
+        self.patch_object(ip.hookenv, 'network_get')
+        self.patch_object(ip.hookenv, 'network_get_primary_address')
+        self.patch_object(ip, '_resolve_network_cidr')
+        self.patch_object(ip.net_ip, 'is_address_in_network')
+        self.addCleanup(ip.flush_address_cache)
+        ip.flush_address_cache()
+        self.network_get.return_value = {
+            'bind-addresses': [
+                {'interfacename': 'eth0',
+                 'addresses': [{'address': '10.0.0.5',
+                                'cidr': '10.0.0.0/24'}]},
+                {'interfacename': 'eth1',
+                 'addresses': [{'address': '10.1.0.5',
+                                'cidr': '10.1.0.0/24'}]},
+            ]}
+        self.assertEqual(ip._get_binding_info('public'),
+                         {'address': '10.0.0.5',
+                          'cidr': '10.0.0.0/24',
+                          'cidrs': ['10.0.0.0/24', '10.1.0.0/24']})
+        self.is_address_in_network.side_effect = (
+            lambda cidr, vip: cidr == '10.1.0.0/24' and vip == 'vip2')
+        self.assertEqual(
+            ip._match_vip_in_binding('public', ['vip1', 'vip2']), 'vip2')
+        self.assertIsNone(ip._match_vip_in_binding('public', ['vip1']))
+        self.network_get.assert_called_once_with('public')
+        self.network_get_primary_address.assert_not_called()
+        self._resolve_network_cidr.assert_not_called()
+        # fall back to the primary address if network-get isn't supported
+        self.network_get.side_effect = NotImplementedError
+        self.network_get_primary_address.return_value = '10.2.0.5'
+        self._resolve_network_cidr.return_value = '10.2.0.0/24'
+        self.assertEqual(ip._get_binding_info('admin')['address'], '10.2.0.5')
+        self._resolve_network_cidr.assert_not_called()
+        self.assertIsNone(ip._match_vip_in_binding('admin', ['vip1']))
+        self._resolve_network_cidr.assert_called_once_with('10.2.0.5')
+        self.network_get_primary_address.assert_called_with('admin')
+        # ... or if it doesn't return the bind addresses
+        self.network_get.side_effect = None
+        self.network_get.return_value = '10.3.0.5'
+        self.network_get_primary_address.return_value = '10.3.0.6'
+        self.assertEqual(ip._get_binding_info('internal')['address'],
+                         '10.3.0.6')
+        # but malformed bind addresses aren't hidden
+        self.network_get.return_value = {
+            'bind-addresses': [{'addresses': [{'cidr': '10.4.0.0/24'}]}]}
+        with self.assertRaises(KeyError):
+            ip._get_binding_info('cluster')
+
     def test_resolve_address(self):
         self.patch_object(ip.cluster, 'is_clustered')
         self.patch_object(ip.hookenv, 'config')
         self.patch_object(ip.hookenv, 'network_get_primary_address')
+        self.patch_object(ip.hookenv, 'network_get')
+        self.network_get.side_effect = NotImplementedError
+        self.addCleanup(ip.flush_address_cache)
         self.patch_object(ip.net_ip, 'is_address_in_network')
         self.patch_object(ip.net_ip, 'get_ipv6_addr')
         self.patch_object(ip.hookenv, 'unit_get')
@@ -86,7 +201,7 @@ class TestCharmOpenStackIp(utils.BaseTestCase):
         self.is_clustered.return_value = False
         self.get_address_in_network.return_value = 'got-address'
         self.unit_get.return_value = 'unit-get-address'
-        addr = ip.resolve_address()
+        addr = ip._resolve_address()
         self.assertEqual(addr, 'got-address')
         self.assertEqual(calls_list,
                          [('os-public-hostname',),
@@ -102,7 +217,7 @@ class TestCharmOpenStackIp(utils.BaseTestCase):
         calls_list = []
         self.get_ipv6_addr.return_value = ['ipv6-addr']
         self.get_address_in_network.reset_mock()
-        addr = ip.resolve_address()
+        addr = ip._resolve_address()
         self.get_ipv6_addr.assert_called_once_with(exc_list=['vip-address'])
         self.get_address_in_network.assert_called_once_with(
             'the-public-network', 'ipv6-addr')
@@ -111,7 +226,7 @@ class TestCharmOpenStackIp(utils.BaseTestCase):
         self.is_clustered.return_value = True
         _config['os-public-network'] = None
         calls_list = []
-        addr = ip.resolve_address()
+        addr = ip._resolve_address()
         self.assertEqual(calls_list, [('os-public-hostname',),
                                       ('vip',),
                                       ('os-public-network',)])
@@ -125,7 +240,7 @@ class TestCharmOpenStackIp(utils.BaseTestCase):
             return True if vip == 'vip2' else False
 
         self.is_address_in_network.side_effect = _fake_addr_in_net
-        addr = ip.resolve_address()
+        addr = ip._resolve_address()
         self.assertEqual(calls_list, [
             ('os-public-hostname',),
             ('vip',),
@@ -138,12 +253,15 @@ class TestCharmOpenStackIp(utils.BaseTestCase):
         self.is_address_in_network.return_value = False
         self.is_address_in_network.side_effect = None
         with self.assertRaises(ValueError):
-            addr = ip.resolve_address()
+            addr = ip._resolve_address()
 
     def test_resolve_address_network_binding(self):
         self.patch_object(ip.cluster, 'is_clustered')
         self.patch_object(ip.hookenv, 'config')
         self.patch_object(ip.hookenv, 'network_get_primary_address')
+        self.patch_object(ip.hookenv, 'network_get')
+        self.network_get.side_effect = NotImplementedError
+        self.addCleanup(ip.flush_address_cache)
         self.patch_object(ip.net_ip, 'is_address_in_network')
         self.patch_object(ip.net_ip, 'get_ipv6_addr')
         self.patch_object(ip.hookenv, 'unit_get')
@@ -175,7 +293,7 @@ class TestCharmOpenStackIp(utils.BaseTestCase):
         self.network_get_primary_address.return_value = 'got-address'
         self._resolve_network_cidr.return_value = 'cidr'
         self.unit_get.return_value = 'unit-get-address'
-        addr = ip.resolve_address()
+        addr = ip._resolve_address()
         self.assertEqual(addr, 'got-address')
         self.assertEqual(calls_list,
                          [('os-public-hostname',),
@@ -194,7 +312,7 @@ class TestCharmOpenStackIp(utils.BaseTestCase):
         calls_list = []
         self.get_ipv6_addr.return_value = ['ipv6-addr']
         self.get_address_in_network.reset_mock()
-        addr = ip.resolve_address()
+        addr = ip._resolve_address()
         self.get_ipv6_addr.assert_called_once_with(exc_list=['vip1', 'vip2'])
         self.network_get_primary_address.assert_called_with(
             'public'
@@ -207,8 +325,9 @@ class TestCharmOpenStackIp(utils.BaseTestCase):
 
         # Third test: clustered
         self.is_clustered.return_value = True
+        ip.flush_address_cache()
         calls_list = []
-        addr = ip.resolve_address()
+        addr = ip._resolve_address()
         self.assertEqual(calls_list, [('os-public-hostname',),
                                       ('vip',),
                                       ('os-public-network',)])
@@ -221,7 +340,7 @@ class TestCharmOpenStackIp(utils.BaseTestCase):
         calls_list = []
         _config['vip'] = 'vip1 vip2'
 
-        addr = ip.resolve_address()
+        addr = ip._resolve_address()
         self.assertEqual(calls_list, [
             ('os-public-hostname',),
             ('vip',),
@@ -237,4 +356,4 @@ class TestCharmOpenStackIp(utils.BaseTestCase):
 #        self.is_address_in_network.return_value = False
 #        self.is_address_in_network.side_effect = None
 #        with self.assertRaises(ValueError):
-#            addr = ip.resolve_address()
+#            addr = ip._resolve_address()
@@ -0,0 +1,154 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+
+import unit_tests.utils as utils
+
+import charms_openstack.os_release_data as os_release_data
+
+
+class TestOSReleaseData(utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestOSReleaseData, self).setUp()
+        os_release_data.flush_release_cache()
+        self.addCleanup(os_release_data.flush_release_cache)
+
+    def test_release_ordinal(self):
+        self.assertEqual(os_release_data.release_ordinal('diablo'), 0)
+        self.assertTrue(os_release_data.release_ordinal('mitaka') <
+                        os_release_data.release_ordinal('newton'))
+        self.assertIsNone(os_release_data.release_ordinal('unknown'))
+        for i, release in enumerate(os_release_data.KNOWN_RELEASES):
+            self.assertEqual(os_release_data.RELEASE_ORDINALS[release], i)
+
+    def test_get_os_codename_install_source(self):
+        self.patch_object(os_release_data.os_utils,
+                          'get_os_codename_install_source',
+                          name='gocis')
+        self.patch_object(os_release_data.ch_host, 'lsb_release',
+                          return_value={'DISTRIB_CODENAME': 'xenial'})
+        self.gocis.side_effect = lambda x: {
+            'distro': 'mitaka',
+            'cloud:xenial-ocata': 'ocata',
+            'deb http://my.archive/ubuntu xenial main': 'newton'}[x]
+        for _ in range(2):
+            self.assertEqual(
+                os_release_data.get_os_codename_install_source('distro'),
+                'mitaka')
+            self.assertEqual(
+                os_release_data.get_os_codename_install_source(
+                    'cloud:xenial-ocata/proposed'),
+                'ocata')
+            self.assertEqual(
+                os_release_data.get_os_codename_install_source(
+                    'deb http://my.archive/ubuntu xenial main'),
+                'newton')
+        # only the deb source needed charmhelpers
+        self.gocis.assert_called_once_with(
+            'deb http://my.archive/ubuntu xenial main')
+        self.assertEqual(self.lsb_release.call_count, 1)
+        os_release_data.flush_release_cache()
+        os_release_data.get_os_codename_install_source('distro')
+        self.assertEqual(self.lsb_release.call_count, 2)
+        # series the registry doesn't know are left to charmhelpers
+        self.lsb_release.return_value = {'DISTRIB_CODENAME': 'unknown'}
+        os_release_data.flush_release_cache()
+        self.assertEqual(
+            os_release_data.get_os_codename_install_source('distro'),
+            'mitaka')
+        self.gocis.assert_called_with('distro')
+
+    def test_get_os_codename_install_source_registered(self):
+        self._patch_registry()
+        self.patch_object(os_release_data.os_utils,
+                          'get_os_codename_install_source',
+                          name='gocis')
+        self.patch_object(os_release_data.ch_host, 'lsb_release',
+                          return_value={'DISTRIB_CODENAME': 'artful'})
+        os_release_data.register_release('pike', series='artful')
+        self.assertEqual(
+            os_release_data.get_os_codename_install_source('distro'),
+            'pike')
+        self.assertEqual(
+            os_release_data.get_os_codename_install_source(
+                'cloud:xenial-pike'),
+            'pike')
+        self.gocis.assert_not_called()
+
+    def _patch_registry(self):
+        for attr in ('KNOWN_RELEASES', 'RELEASE_ORDINALS', 'UBUNTU_SERIES',
+                     'RELEASE_VERSIONS', 'PACKAGE_CODENAMES',
+                     '_package_codenames'):
+            self.patch_object(os_release_data, attr,
+                              new=type(getattr(os_release_data, attr))(
+                                  getattr(os_release_data, attr)))
+
+    def test_release_for_series(self):
+        self.assertEqual(os_release_data.release_for_series('xenial'),
+                         'mitaka')
+        self.assertIsNone(os_release_data.release_for_series('unknown'))
+
+    def test_release_version(self):
+        self.patch_object(os_release_data.os_utils, 'OPENSTACK_CODENAMES',
+                          new={'2011.2': 'my-series'})
+        self.assertEqual(os_release_data.release_version('ocata'), '2017.1')
+        self.assertEqual(os_release_data.release_version('my-series'),
+                         '2011.2')
+        self.assertIsNone(os_release_data.release_version('unknown'))
+
+    def test_register_release(self):
+        self._patch_registry()
+        self.patch_object(os_release_data.os_utils, 'PACKAGE_CODENAMES',
+                          new={'nova-common': {'15': 'ocata'}})
+        self.assertEqual(os_release_data.get_package_codenames(),
+                         {'nova-common': {'15': 'ocata'}})
+        os_release_data.register_release(
+            'pike', series='artful', version='2017.2',
+            packages={'nova-common': 16, 'new-package': '1'})
+        self.assertEqual(os_release_data.KNOWN_RELEASES[-1], 'pike')
+        self.assertTrue(os_release_data.release_ordinal('ocata') <
+                        os_release_data.release_ordinal('pike'))
+        self.assertEqual(os_release_data.release_for_series('artful'), 'pike')
+        self.assertEqual(os_release_data.release_version('pike'), '2017.2')
+        self.assertEqual(os_release_data.get_package_codenames(),
+                         {'nova-common': {'15': 'ocata', '16': 'pike'},
+                          'new-package': {'1': 'pike'}})
+        # registering a known release again doesn't move it
+        size = len(os_release_data.KNOWN_RELEASES)
+        os_release_data.register_release('mitaka', version='2016.1')
+        self.assertEqual(len(os_release_data.KNOWN_RELEASES), size)
+        self.assertEqual(os_release_data.release_ordinal('mitaka'), 9)
+
+    def test_load_release_data(self):
+        self._patch_registry()
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'releases.json')
+        with open(path, 'w') as f:
+            json.dump({'releases': [
+                {'name': 'pike', 'series': 'artful', 'version': '2017.2'},
+                {'name': 'queens', 'version': '2018.1'},
+            ]}, f)
+        os_release_data.load_release_data(path)
+        self.assertEqual(os_release_data.KNOWN_RELEASES[-2:],
+                         ['pike', 'queens'])
+        self.assertEqual(os_release_data.release_for_series('artful'), 'pike')
+        self.assertEqual(os_release_data.release_version('queens'), '2018.1')